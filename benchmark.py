@@ -0,0 +1,358 @@
+"""
+Benchmarks for each geometry and rendering stage.
+
+Every workload is built from fixed seeds, and measured in a fresh process, so caches and memory left
+behind by other workloads don't skew it. Results are written as JSON, and can be compared against a
+baseline:
+
+    python benchmark.py -o baseline.json
+    python benchmark.py -o new.json --baseline baseline.json --threshold .2
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import shapely
+from shapely.ops import linemerge
+
+import crazy_paths
+from utils import gcode, strokes, toolpath
+from utils.geom import DEFAULT_TOLERANCE, all_geoms, bezier_batch, compose, draw_shape, flattening_report, rect, rounded, text
+from utils.svg import SVGWriter
+
+log = logging.getLogger("benchmark")
+
+SEED = 1234
+
+DEFAULT_GRID_SIZES = [4, 6, 12, 24]
+DEFAULT_TOLERANCES = [.01, .05, DEFAULT_TOLERANCE, .2]
+DEFAULT_FONTS = ["futural", "timesr", "scripts", "gothiceng"]
+
+# Measured times below this (in seconds) are too noisy to call regressions
+NOISE_FLOOR = .005
+
+# A stage measured with one grid size, tolerance and font (None where the stage doesn't depend on it)
+Workload = collections.namedtuple("Workload", ["stage", "grid_size", "tolerance", "font"])
+
+def clear_caches():
+    """ Drops every cached build stage and template, so stages are measured from scratch """
+    for function in (
+        crazy_paths.connection_paths, crazy_paths.get_outline, crazy_paths.get_main_board_cuts,
+        crazy_paths.get_slot_labels, crazy_paths.get_front_board, crazy_paths.link_path,
+        crazy_paths.piece_offsets, crazy_paths.piece_outline,
+    ):
+        function.cache_clear()
+
+def board_links(config):
+    return crazy_paths.get_board_links(config, "random", random.Random(SEED))
+
+def board_pieces(config):
+    return [
+        (piece_x, piece_y, piece_links)
+        for (piece_x, piece_y), piece_links in zip(crazy_paths.enum_pieces(config), board_links(config))
+    ]
+
+def piece_paths(config, piece_x, piece_y, piece_links):
+    return crazy_paths.piece_paths(piece_x, piece_y, piece_links, config.entry_distance, config.adaptive_flattening)
+
+def board_paths(config):
+    paths = list(crazy_paths.connection_paths(config))
+    for piece_x, piece_y, piece_links in board_pieces(config):
+        paths += piece_paths(config, piece_x, piece_y, piece_links)
+    return paths
+
+# Each stage takes its workload, and returns the function to measure, after any setup it needs
+
+def bezier_controls():
+    """ Random cubic curves, the size of a piece """
+    return np.random.default_rng(SEED).uniform(0, 40, (1000, 4, 2))
+
+def bench_bezier(workload, config):
+    controls = bezier_controls()
+    return lambda: list(bezier_batch(controls, tolerance=workload.tolerance, adaptive=True))
+
+def bench_bezier_uniform(workload, config):
+    controls = bezier_controls()
+    return lambda: list(bezier_batch(controls, tolerance=workload.tolerance, adaptive=False))
+
+def bench_rounded(workload, config):
+    holes = compose([
+        rect(piece_x, piece_y)
+        for piece_x, piece_y in crazy_paths.enum_pieces(config)
+    ])
+    return lambda: rounded(holes, radius=config.piece_arc, tolerance=workload.tolerance)
+
+def bench_text(workload, config):
+    return lambda: text("The quick brown fox jumps over the lazy dog 0123456789", font=workload.font)
+
+def bench_connection_paths(workload, config):
+    return lambda: (clear_caches(), crazy_paths.connection_paths(config))[1]
+
+def bench_piece_paths(workload, config):
+    pieces = board_pieces(config)
+    def run():
+        clear_caches()
+        return [
+            path
+            for piece_x, piece_y, piece_links in pieces
+            for path in piece_paths(config, piece_x, piece_y, piece_links)
+        ]
+    return run
+
+def bench_linemerge(workload, config):
+    paths = board_paths(config)
+    return lambda: linemerge(paths)
+
+def bench_offsets(workload, config):
+    pieces = board_pieces(config)
+    return lambda: (clear_caches(), crazy_paths.path_offsets(config, pieces))[1]
+
+def bench_cuts(workload, config):
+    return lambda: (clear_caches(), crazy_paths.get_main_board_cuts(config))[1]
+
+def bench_compose(workload, config):
+    cuts, engravings = crazy_paths.get_main_board(config, board_links(config))
+    parts = list(all_geoms(cuts, engravings))
+    return lambda: compose(parts)
+
+def bench_main_board(workload, config):
+    links = board_links(config)
+    return lambda: (clear_caches(), crazy_paths.get_main_board(config, links))[1]
+
+def bench_deduplicate(workload, config):
+    cuts, _ = crazy_paths.get_main_board(config, board_links(config))
+    return lambda: strokes.deduplicate(cuts.boundary, name="benchmark")
+
+def bench_toolpath(workload, config):
+    cuts, _ = crazy_paths.get_main_board(config, board_links(config))
+    lines = strokes.deduplicate(cuts.boundary, name="benchmark")
+    return lambda: toolpath.optimize(lines, nested=True, containers=cuts, name="benchmark")
+
+def _rendering_input(config):
+    cuts, engravings = crazy_paths.get_main_board(config, board_links(config))
+    return crazy_paths.cut_paths(cuts, "benchmark"), crazy_paths.engraving_paths(engravings, "benchmark")
+
+def bench_svg(workload, config):
+    cut_paths, engraving_paths = _rendering_input(config)
+    def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with SVGWriter(f"{tmp_dir}/cut.svg", config.total_width, config.total_height) as svg:
+                svg.stroke(cut_paths, color=(0, 0, 0), line_width=.1)
+                svg.stroke(engraving_paths, color=(0, 0, 1), line_width=.2)
+        return cut_paths, engraving_paths
+    return run
+
+def bench_gcode(workload, config):
+    cut_paths, engraving_paths = _rendering_input(config)
+    laser = gcode.LaserSettings()
+    def run():
+        layers = [
+            (layer, laser.profiles[layer], (shapely.get_coordinates(path) for path in paths))
+            for layer, paths in [("engraving", engraving_paths), ("cut", cut_paths)]
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gcode.write_job(f"{tmp_dir}/job.gcode", gcode.gcode_lines(layers, config.total_height))
+        return cut_paths, engraving_paths
+    return run
+
+def bench_draw_shape(workload, config):
+    # Only this stage needs cairo
+    import cairo
+
+    cuts, engravings = crazy_paths.get_main_board(config, board_links(config))
+    def run():
+        surface = cairo.RecordingSurface(cairo.Content.COLOR_ALPHA, None)
+        context = cairo.Context(surface)
+        draw_shape(context, cuts)
+        context.fill()
+        draw_shape(context, engravings)
+        context.stroke()
+        return cuts, engravings
+    return run
+
+# Stage functions, and which of grid size, tolerance and font each one is measured across
+STAGES = {
+    "bezier": (bench_bezier, ("tolerance",)),
+    "bezier_uniform": (bench_bezier_uniform, ("tolerance",)),
+    "rounded": (bench_rounded, ("grid_size", "tolerance")),
+    "text": (bench_text, ("font",)),
+    "connection_paths": (bench_connection_paths, ("grid_size",)),
+    "piece_paths": (bench_piece_paths, ("grid_size",)),
+    "linemerge": (bench_linemerge, ("grid_size",)),
+    "offsets": (bench_offsets, ("grid_size",)),
+    "cuts": (bench_cuts, ("grid_size",)),
+    "compose": (bench_compose, ("grid_size",)),
+    "main_board": (bench_main_board, ("grid_size",)),
+    "deduplicate": (bench_deduplicate, ("grid_size",)),
+    "toolpath": (bench_toolpath, ("grid_size",)),
+    "svg": (bench_svg, ("grid_size",)),
+    "gcode": (bench_gcode, ("grid_size",)),
+    "draw_shape": (bench_draw_shape, ("grid_size",)),
+}
+
+def workloads(stages, grid_sizes, tolerances, fonts):
+    values = { "grid_size": grid_sizes, "tolerance": tolerances, "font": fonts }
+    for stage in stages:
+        dimensions = STAGES[stage][1]
+        for combination in itertools.product(*(values[dimension] for dimension in dimensions)):
+            yield Workload(stage, **{
+                dimension: dict(zip(dimensions, combination)).get(dimension)
+                for dimension in ("grid_size", "tolerance", "font")
+            })
+
+def count_vertices(result):
+    geoms = np.array(list(all_geoms(result)), dtype=object)
+    return int(shapely.get_num_coordinates(geoms).sum()) if len(geoms) else 0
+
+def _memory_status(field):
+    with open("/proc/self/status") as f:
+        return int(re.search(rf"^{field}:\s+(\d+) kB", f.read(), re.MULTILINE).group(1)) << 10
+
+def reset_peak_memory():
+    """
+    Resets the peak resident memory of this process, returning its current resident memory, in bytes.
+
+    Where the peak can't be reset (anywhere but Linux), the current peak is returned instead, so
+    only memory used beyond it is measured.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _memory_status("VmRSS")
+    except OSError:
+        return peak_memory()
+
+def peak_memory():
+    """ Peak resident memory of this process, in bytes """
+    try:
+        return _memory_status("VmHWM")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak << 10
+
+def measure(workload, repeat):
+    """ Runs a workload, returning its time (best and median of `repeat` runs), peak memory and vertex count """
+    config = crazy_paths.BoardConfig.make(grid_size=workload.grid_size or crazy_paths.BASE_PARAMETERS["grid_size"])
+    run = STAGES[workload.stage][0](workload, config)
+
+    # Peak memory is measured over the first run, from the memory in use after the setup
+    base_memory = reset_peak_memory()
+    result = run()
+    memory = peak_memory() - base_memory
+    vertices = count_vertices(result)
+    del result
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return dict(
+        workload._asdict(), time=min(times), median_time=statistics.median(times),
+        peak_memory=memory, vertices=vertices)
+
+def run_benchmarks(workloads, repeat=3):
+    results = []
+    skipped = set()
+    for workload in workloads:
+        if workload.stage in skipped:
+            continue
+        # A new process for each workload, so it starts with empty caches
+        with concurrent.futures.ProcessPoolExecutor(1, max_tasks_per_child=1) as executor:
+            try:
+                result = executor.submit(measure, workload, repeat).result()
+            except ImportError as e:
+                log.warning("%s: skipped, %s", workload.stage, e)
+                skipped.add(workload.stage)
+                continue
+        log.info(
+            "%-16s %-20s %9.4fs %8.1fMB %10d vertices",
+            workload.stage, describe(workload), result["time"], result["peak_memory"] / 2**20, result["vertices"])
+        results.append(result)
+    return results
+
+def describe(workload):
+    return " ".join(
+        f"{name}={value}"
+        for name, value in zip(("grid", "tol", "font"), workload[1:])
+        if value is not None)
+
+def compare(results, baseline, threshold):
+    """ Logs the changes from `baseline`, returning the workloads that got slower or bigger by more than `threshold` """
+    def key(result):
+        return tuple(result[field] for field in Workload._fields)
+
+    baseline = { key(result): result for result in baseline["results"] }
+    regressions = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        time_change = result["time"] / old["time"] - 1 if old["time"] else 0
+        memory_change = result["peak_memory"] / old["peak_memory"] - 1 if old["peak_memory"] else 0
+        regressed = (
+            (time_change > threshold and result["time"] - old["time"] > NOISE_FLOOR) or
+            (memory_change > threshold and result["peak_memory"] - old["peak_memory"] > 1 << 20))
+        log.info(
+            "%-16s %-20s time %+7.1f%%, memory %+7.1f%%, vertices %+d%s",
+            result["stage"], describe(Workload(*key(result))), 100 * time_change, 100 * memory_change,
+            result["vertices"] - old["vertices"], "  REGRESSION" if regressed else "")
+        if regressed:
+            regressions.append(result)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks each geometry and rendering stage")
+    parser.add_argument("--stages", choices=STAGES, nargs="+", default=list(STAGES), help="Stages to measure (default: all)")
+    parser.add_argument("--grid-size", type=int, nargs="+", default=DEFAULT_GRID_SIZES, help=f"Grid sizes (default: {' '.join(map(str, DEFAULT_GRID_SIZES))})")
+    parser.add_argument("--tolerance", type=float, nargs="+", default=DEFAULT_TOLERANCES, help=f"Flattening tolerances (default: {' '.join(map(str, DEFAULT_TOLERANCES))})")
+    parser.add_argument("--fonts", nargs="+", default=DEFAULT_FONTS, help=f"Fonts (default: {' '.join(DEFAULT_FONTS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each workload, the best one is kept (default: 3)")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file for the results (default: benchmark.json)")
+    parser.add_argument("--baseline", metavar="FILE", help="Results to compare against, exiting with an error on regressions")
+    parser.add_argument("--threshold", type=float, default=.2, help="Relative increase in time or memory counted as a regression (default: .2)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Stages log their own progress, which would drown the results
+    for name in ("strokes", "toolpath", "arcs"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = run_benchmarks(workloads(args.stages, args.grid_size, args.tolerance, args.fonts), args.repeat)
+
+    # Vertices saved and time taken by adaptive flattening, against the uniform sampling it replaced
+    flattening = {}
+    if "bezier" in args.stages:
+        flattening = { str(tolerance): flattening_report(bezier_controls(), tolerance) for tolerance in args.tolerance }
+
+    with open(args.output, "w") as f:
+        json.dump(dict(
+            python=platform.python_version(), numpy=np.__version__, shapely=shapely.__version__,
+            geos=shapely.geos_version_string, machine=platform.machine(), cpus=os.cpu_count(),
+            seed=SEED, repeat=args.repeat, results=results, flattening=flattening,
+        ), f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            log.error("%d regressions over %.0f%%", len(regressions), 100 * args.threshold)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,146 @@
 #!/usr/bin/env python3
 
-import cairo
 import shapely
 import random
+import argparse
+import atexit
+import hashlib
+import collections
+import json
+import os
+import pathlib
+import pickle
+import sys
+import tempfile
+import time
+import logging
+import zipfile
 from shapely.affinity import translate
 from shapely.geometry import *
 from shapely.ops import unary_union, polygonize, linemerge, split
 import itertools
+import functools
 from utils.geom import *
+from utils import arcs, gcode, nesting, raster, strokes, tiles, toolpath, trace, tsuro
+from utils.svg import SVGWriter
+from utils.parallel import SerialExecutor, process_executor, thread_executor
+from utils.server import RequestServer
+from utils.cache import BuildCache, code_version, content_key, default_cache_dir
 
-piece_size = 40
-piece_spacing = 3
-piece_outer_spacing = 2*piece_spacing
-piece_arc = 10
-grid_arc = 2
-grid_size = 6
-piece_distance = 0
-border_distance = 0
-entry_distance = (piece_size + piece_spacing)/3
-parallel_distances = [.75, 1.5]
-path_to_edge_distance = piece_spacing + parallel_distances[-1]
-slots_height = piece_size/4
-slots_line_height = piece_size/10
-handle_size=10
-
-total_width = grid_size * piece_size + (grid_size+3) * piece_spacing
-total_height = total_width + slots_height + (piece_spacing if slots_height else 0)
+# Default board parameters, see `BoardConfig`
+BASE_PARAMETERS = {
+    "piece_size": 40,
+    "piece_spacing": 3,
+    "piece_arc": 10,
+    "grid_arc": 2,
+    "grid_size": 6,
+    "piece_distance": 0,
+    "parallel_distances": (.75, 1.5),
+    "handle_size": 10,
+    "adaptive_flattening": True,
+    "title": ("Caminhos   ", "   Malucos"),
+    "signature": "Tio Paulo - Junho/2019",
+}
+
+# Parameters computed from the others, unless given explicitly
+DERIVED_PARAMETERS = {
+    "entry_distance": lambda config: (config.piece_size + config.piece_spacing)/3,
+    "path_to_edge_distance": lambda config: config.piece_spacing + config.parallel_distances[-1],
+    "slots_height": lambda config: config.piece_size/4,
+    "slots_line_height": lambda config: config.piece_size/10,
+}
+
+class BoardConfig(collections.namedtuple("BoardConfig", [*BASE_PARAMETERS, *DERIVED_PARAMETERS])):
+    """
+    Immutable board parameters, which every build stage takes as its first argument.
+
+    Create it with `BoardConfig.make(**params)`, which fills in the defaults and derived parameters.
+    Boards with different configs can be built in the same process, from any thread.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, **params):
+        """ Config with the default parameters, overridden by `params` """
+        unknown = set(params) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        params = { name: tuple(value) if isinstance(value, list) else value for name, value in params.items() }
+        config = cls(**{ **BASE_PARAMETERS, **dict.fromkeys(DERIVED_PARAMETERS), **params })
+        return config._replace(**{
+            name: derive(config)
+            for name, derive in DERIVED_PARAMETERS.items()
+            if name not in params
+        })
+
+    @property
+    def total_width(self):
+        return self.grid_size * self.piece_size + (self.grid_size+3) * self.piece_spacing
+
+    @property
+    def total_height(self):
+        return self.total_width + self.slots_height + (self.piece_spacing if self.slots_height else 0)
+
+DEFAULT_CONFIG = BoardConfig.make()
+
+# Parameters each build stage depends on
+_WIDTH = ("piece_size", "piece_spacing", "grid_size")
+_HEIGHT = _WIDTH + ("slots_height",)
+STAGES = {
+    "outline": _HEIGHT + ("grid_arc", "handle_size"),
+    "holes": _HEIGHT + ("grid_arc", "handle_size", "piece_distance", "piece_arc", "entry_distance", "slots_line_height"),
+    "paths": _WIDTH + ("entry_distance", "path_to_edge_distance", "adaptive_flattening"),
+    "offsets": _WIDTH + ("entry_distance", "path_to_edge_distance", "adaptive_flattening", "parallel_distances"),
+    "labels": _HEIGHT + ("entry_distance",),
+    "title": _HEIGHT + ("grid_arc", "handle_size", "title", "signature"),
+}
+
+PART_STAGES = {
+    "main": ("outline", "holes", "paths", "offsets", "labels"),
+    "back": ("outline",),
+    "front": ("outline", "title"),
+}
+
+# Templates (link paths, tile offsets, piece outlines) kept in memory, enough for many board configs
+# while bounding a long-running process (e.g. `--serve`) that sees arbitrary parameters
+TEMPLATE_CACHE_SIZE = 1024
+
+def stage_parameters(config, *stages):
+    names = sorted({ name for stage in stages for name in STAGES[stage] })
+    return tuple((name, getattr(config, name)) for name in names)
+
+class _StageKey:
+    """ A config, compared and hashed only by the parameters of a stage """
+    __slots__ = ("parameters", "config")
+
+    def __init__(self, parameters, config):
+        self.parameters = parameters
+        self.config = config
+
+    def __eq__(self, other):
+        return self.parameters == other.parameters
+
+    def __hash__(self):
+        return hash(self.parameters)
+
+def stage(name):
+    """
+    Caches a build stage by the parameters it depends on.
+
+    Geometry is shared by every board with the same parameters, and only the stages affected by
+    a parameter change are rebuilt.
+    """
+    def decorator(function):
+        traced = trace.traced(name, vertices=True)(function)
+        cached = functools.lru_cache(maxsize = 16)(lambda key, *args, **kwargs: traced(key.config, *args, **kwargs))
+
+        @functools.wraps(function)
+        def wrapper(config, *args, **kwargs):
+            return cached(_StageKey(stage_parameters(config, name), config), *args, **kwargs)
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
 
 # Piece layout:
 #     |  |
@@ -53,54 +168,64 @@ default_piece_links = [
 ]
 #random.shuffle(default_piece_links)
 
-def random_piece_links():
-    perm = list(range(8))
-    random.shuffle(perm)
-
-    return [
-        (perm[i], perm[i+1])
-        for i in range(0, len(perm), 2)
-    ]
-
-def enum_pieces():
-    for i in range(grid_size):
-        for j in range(grid_size):
+def enum_pieces(config):
+    piece_size, piece_spacing = config.piece_size, config.piece_spacing
+    for i in range(config.grid_size):
+        for j in range(config.grid_size):
             x = [ 2 * piece_spacing + (piece_size + piece_spacing) * j,  2 * piece_spacing + (piece_size + piece_spacing) * j + piece_size ]
             y = [ 2 * piece_spacing + (piece_size + piece_spacing) * i,  2 * piece_spacing + (piece_size + piece_spacing) * i + piece_size ]
             yield x, y
 
-def enum_piece_links():
+def default_tiles(rng):
     yield from default_piece_links
-    while True:
-        yield random_piece_links()
+    yield from tiles.distinct_tiles(exclude=default_piece_links, rng=rng)
+
+def shuffled_tiles(rng):
+    piece_links = list(default_piece_links)
+    rng.shuffle(piece_links)
+    yield from piece_links
+    yield from tiles.distinct_tiles(exclude=default_piece_links, rng=rng)
+
+def random_tiles(rng):
+    yield from tiles.distinct_tiles(rng=rng)
+
+TILE_POLICIES = {
+    "default": default_tiles,
+    "shuffled": shuffled_tiles,
+    "random": random_tiles,
+}
+
+def enum_piece_links(policy="default", rng=random):
+    return TILE_POLICIES[policy](rng)
+
+@stage("paths")
+def connection_paths(config):
+    piece_size, piece_spacing, grid_size = config.piece_size, config.piece_spacing, config.grid_size
+    entry_distance, path_to_edge_distance = config.entry_distance, config.path_to_edge_distance
+    segments = []
 
-def connection_paths():
     # Horizontal lines
     for i in range(grid_size):
         for j in range(grid_size+1):
             x0 = path_to_edge_distance if j == 0 else (piece_spacing + piece_size) * j + piece_spacing
-            x1 = total_width - path_to_edge_distance if j == grid_size else (piece_spacing + piece_size) * j + 2 * piece_spacing
+            x1 = config.total_width - path_to_edge_distance if j == grid_size else (piece_spacing + piece_size) * j + 2 * piece_spacing
             y = 2 * piece_spacing + i * (piece_spacing + piece_size)
 
             for pos in (piece_size - entry_distance) / 2, (piece_size + entry_distance) / 2:
-                yield bezier((x0, y+pos), (x1, y+pos))
-                yield bezier((y+pos, x0), (y+pos, x1))
+                segments.append(((x0, y+pos), (x1, y+pos)))
+                segments.append(((y+pos, x0), (y+pos, x1)))
 
+    return list(snap(bezier_batch(segments, adaptive=config.adaptive_flattening)))
 
-def piece_paths(piece_x, piece_y, piece_links):
-    w = piece_x[1] - piece_x[0]
-    x0 = piece_x[0]
-    x1_3 = x0 + (w - entry_distance) / 2
-    x2_3 = x0 + (w + entry_distance) / 2
-    x1 = x0 + w
 
-    h = piece_y[1] - piece_y[0]
-    y0 = piece_y[0]
-    y1_3 = y0 + (h - entry_distance) / 2
-    y2_3 = y0 + (h + entry_distance) / 2
-    y1 = y0 + h
+def piece_entries(size, entry_distance):
+    """ Position and inward direction of each entry, relative to the center of the piece """
+    x0 = y0 = -size / 2
+    x1_3 = y1_3 = -entry_distance / 2
+    x2_3 = y2_3 = entry_distance / 2
+    x1 = y1 = size / 2
 
-    entries = [
+    return [
       ((x1_3, y0), (0, 1)),
       ((x2_3, y0), (0, 1)),
       ((x1_3, y1), (0, -1)),
@@ -111,27 +236,132 @@ def piece_paths(piece_x, piece_y, piece_links):
       ((x1, y2_3), (-1, 0)),
     ]
 
+@functools.lru_cache(maxsize = TEMPLATE_CACHE_SIZE)
+def link_path(link, size, entry_distance, adaptive):
+    """ Path of a (canonical) link, relative to the center of the piece """
+    entries = piece_entries(size, entry_distance)
+
+    a, b = entries[link[0]], entries[link[1]]
+    scale = max(abs(a[0][0] - b[0][0]), abs(a[0][1] - b[0][1]))
+    if a[1] == b[1]:
+        scale *= .75
+    else:
+        scale *= 0.5
+
+    return bezier(
+        (a[0][0], a[0][1]),
+        (a[0][0] + scale * a[1][0], a[0][1] + scale * a[1][1]),
+        (b[0][0] + scale * b[1][0], b[0][1] + scale * b[1][1]),
+        (b[0][0], b[0][1]),
+        adaptive=adaptive
+    )
+
+def piece_paths(piece_x, piece_y, piece_links, entry_distance, adaptive):
+    center = ((piece_x[0] + piece_x[1]) / 2, (piece_y[0] + piece_y[1]) / 2)
+
+    paths = []
+    matrices = []
     for link in piece_links:
-        a, b = entries[link[0]], entries[link[1]]
-        scale = max(abs(a[0][0] - b[0][0]), abs(a[0][1] - b[0][1]))
-        if a[1] == b[1]:
-            scale *= .75
-        else:
-            scale *= 0.5
+        canonical, matrix = tiles.canonical_link(link)
+        paths.append(link_path(canonical, piece_x[1] - piece_x[0], entry_distance, adaptive))
+        matrices.append(matrix)
 
-        yield bezier(
-            (a[0][0], a[0][1]),
-            (a[0][0] + scale * a[1][0], a[0][1] + scale * a[1][1]),
-            (b[0][0] + scale * b[1][0], b[0][1] + scale * b[1][1]),
-            (b[0][0], b[0][1])
-        )
+    # Ports must match the ends of the connection paths exactly, or linemerge won't join them
+    return list(snap(place(paths, matrices, [center] * len(paths))))
+
+@functools.lru_cache(maxsize = TEMPLATE_CACHE_SIZE)
+def piece_offsets(canonical_id, borders, size, entry_distance, spacing, border_stub, distances, adaptive):
+    """
+    Parallel offsets of the paths of a canonical tile, for each of `distances`, relative to its center.
+
+    A piece owns the region up to half-way to its neighbours, or up to the board edge on the
+    `borders` sides (top, bottom, left, right). The paths are extended straight out of the piece
+    across that region, so the offsets of neighbouring pieces meet exactly half-way between them.
+    """
+    entries = piece_entries(size, entry_distance)
+
+    paths = piece_paths([-size/2, size/2], [-size/2, size/2], tiles.CANONICAL_TILES[canonical_id], entry_distance, adaptive)
+    for port, ((x, y), (dx, dy)) in enumerate(entries):
+        length = border_stub if borders[port // 2] else spacing
+        paths.append(LineString([(x, y), (x - length * dx, y - length * dy)]))
+    paths = MultiLineString(paths)
+
+    margins = [size if border else spacing / 2 for border in borders]
+    region = rect(
+        [-size/2 - margins[2], size/2 + margins[3]],
+        [-size/2 - margins[0], size/2 + margins[1]])
+
+    offsets = []
+    for distance in distances:
+        with trace.span("buffer_boundary", vertices_in=int(shapely.get_num_coordinates(paths))) as s:
+            offsets.append(paths.buffer(distance).boundary & region)
+            s.set(vertices_out=int(shapely.get_num_coordinates(offsets[-1])))
+    return tuple(offsets)
+
+def _merge_offsets(offsets, matrices, centers):
+    # Round off float noise, so that the offsets of neighbouring pieces meet exactly
+    offsets = snap(place(offsets, matrices, centers))
+    return linemerge(shapely.get_parts(offsets).tolist())
+
+@trace.traced("offsets", vertices=True)
+def path_offsets(config, pieces, executor=None):
+    """
+    Parallel offsets of all paths on the board, as one merged geometry for each of `parallel_distances`.
+
+    `pieces` is a list of `(piece_x, piece_y, piece_links)`, in `enum_pieces` order. This is equivalent
+    to buffering the whole path network, but the offsets are computed (and cached) once for each
+    canonical tile and border layout, and then rotated or reflected into place. The buffers of
+    different templates, and the merges of different distances, are run on `executor`.
+    """
+    executor = executor or SerialExecutor()
+    grid_size = config.grid_size
+
+    template_args = []
+    matrices = []
+    centers = []
+    for index, (piece_x, piece_y, piece_links) in enumerate(pieces):
+        i, j = divmod(index, grid_size)
+        borders = (i == 0, i == grid_size - 1, j == 0, j == grid_size - 1)
+
+        canonical_id, rotation, reflected = tiles.tile_symmetry(piece_links)
+        matrix, permutation = tiles.SYMMETRIES[4 * reflected + rotation]
+        # Side `s` of the canonical tile ends up on the side of its port `2*s`
+        canonical_borders = tuple(borders[permutation[2 * side] // 2] for side in range(4))
+
+        template_args.append((
+            canonical_id,
+            canonical_borders,
+            config.piece_size,
+            config.entry_distance,
+            config.piece_spacing,
+            2 * config.piece_spacing - config.path_to_edge_distance,
+            tuple(config.parallel_distances),
+            config.adaptive_flattening))
+        matrices.append(matrix)
+        centers.append(((piece_x[0] + piece_x[1]) / 2, (piece_y[0] + piece_y[1]) / 2))
+
+    unique_args = list(dict.fromkeys(template_args))
+    unique_templates = dict(zip(unique_args, executor.map(piece_offsets, *zip(*unique_args))))
+    templates = [unique_templates[args] for args in template_args]
+
+    return list(executor.map(
+        _merge_offsets, zip(*templates), itertools.repeat(matrices), itertools.repeat(centers)))
+
+@functools.lru_cache(maxsize = TEMPLATE_CACHE_SIZE)
+def piece_outline(size, distance, radius):
+    """ Rounded outline of a piece, with its corner at the origin """
+    return rounded(rect([0, size], [0, size]).buffer(-distance), radius=radius)
+
+@stage("outline")
+def get_outline(config, border=True):
+    piece_spacing, handle_size = config.piece_spacing, config.handle_size
+    total_width, total_height = config.total_width, config.total_height
 
-def get_outline(border=True):
     outline = rect([0, total_width], [0, total_height])
     outline = rounded(outline, radius=2 * piece_spacing)
 
     inner_outline = outline.buffer(-piece_spacing)
-    inner_outline = rounded(inner_outline, radius=piece_spacing + grid_arc)
+    inner_outline = rounded(inner_outline, radius=piece_spacing + config.grid_arc)
 
     handles = compose([
         rect([0, piece_spacing], [total_height-piece_spacing, total_height]),
@@ -148,13 +378,18 @@ def get_outline(border=True):
         return compose(inner_outline, outline - inner_outline)
 
 
-def get_main_board():
+@stage("holes")
+def get_main_board_cuts(config):
+    piece_spacing, slots_height, entry_distance = config.piece_spacing, config.slots_height, config.entry_distance
+    total_width, total_height = config.total_width, config.total_height
+
     holes = []
     pieces = []
-    for piece_x, piece_y in enum_pieces():
-        piece = rect(piece_x, piece_y)
-        holes.append(rounded(piece, radius=grid_arc))
-        pieces.append(rounded(piece.buffer(-piece_distance), radius=piece_arc))
+    hole = piece_outline(config.piece_size, 0, config.grid_arc)
+    piece = piece_outline(config.piece_size, config.piece_distance, config.piece_arc)
+    for piece_x, piece_y in enum_pieces(config):
+        holes.append(translate(hole, xoff=piece_x[0], yoff=piece_y[0]))
+        pieces.append(translate(piece, xoff=piece_x[0], yoff=piece_y[0]))
     holes = compose(holes)
     pieces = compose(pieces)
 
@@ -168,122 +403,691 @@ def get_main_board():
                 1.5*piece_spacing + (i+.5)*entry_distance,
                 total_height - 2*piece_spacing - slots_height / 2
             ).buffer(slots_height / 2)
-            for i in range(3*grid_size)
+            for i in range(3*config.grid_size)
         ]
 
-        holes = compose(holes, slot_line.buffer(slots_line_height / 2).union(compose(slot_pieces)).buffer(4).buffer(-4))
+        holes = compose(holes, slot_line.buffer(config.slots_line_height / 2).union(compose(slot_pieces)).buffer(4).buffer(-4))
         pieces = compose(pieces, slot_pieces)
 
-    cuts = compose(
+    return compose(
         pieces,
-        [ g - holes for g in all_geoms(get_outline()) ]
+        shapely.difference(all_geoms(get_outline(config)), holes)
     )
 
-
-    all_paths = list(connection_paths())
-
-    for (piece_x, piece_y), piece_links in zip(enum_pieces(), enum_piece_links()):
-        all_paths += list(piece_paths(piece_x, piece_y, piece_links))
-
-    all_paths = linemerge(all_paths)
-
-
-    all_paths_offsets = [all_paths]
-    for offset in parallel_distances:
-        all_paths_offsets.append(all_paths.buffer(offset).boundary)
-
-    slot_piece_labels = [
+@stage("labels")
+def get_slot_labels(config):
+    piece_spacing = config.piece_spacing
+    return [
         text(chr(ord("A") + i),
              scale=.2,
              translate=(
-                1.5*piece_spacing + (i+.5)*entry_distance,
-                total_height - 2*piece_spacing - slots_height / 2
+                1.5*piece_spacing + (i+.5)*config.entry_distance,
+                config.total_height - 2*piece_spacing - config.slots_height / 2
             )
         )
-        for i in range(3*grid_size)
+        for i in range(3*config.grid_size)
     ]
+
+def get_board_links(config, tiles="default", rng=random):
+    return [
+        tuple(tuple(link) for link in piece_links)
+        for piece_links in itertools.islice(enum_piece_links(tiles, rng), config.grid_size * config.grid_size)
+    ]
+
+def get_main_board(config, board_links=None, executor=None):
+    """
+    Cuts and engravings of the main board.
+
+    The cuts and the path offsets don't depend on each other, they are run concurrently on
+    `executor`, if given (a thread pool is enough, shapely releases the GIL while buffering).
+    """
+    executor = executor or SerialExecutor()
+    if board_links is None:
+        board_links = get_board_links(config)
+
+    cuts = executor.submit(get_main_board_cuts, config)
+    labels = executor.submit(get_slot_labels, config)
+
+    board_pieces = [
+        (piece_x, piece_y, piece_links)
+        for (piece_x, piece_y), piece_links in zip(enum_pieces(config), board_links)
+    ]
+    offsets = path_offsets(config, board_pieces, executor)
+
+    all_paths = list(connection_paths(config))
+    for piece_x, piece_y, piece_links in board_pieces:
+        all_paths += piece_paths(piece_x, piece_y, piece_links, config.entry_distance, config.adaptive_flattening)
+
+    with trace.span("linemerge"):
+        all_paths = linemerge(all_paths)
+
+
+    all_paths_offsets = [all_paths] + offsets
+
     engravings = compose(
         all_paths_offsets,
-        slot_piece_labels)
+        labels.result())
 
-    return  cuts, engravings
+    return  cuts.result(), engravings
 
 
-def get_back_board():
-    return get_outline(), []
+def get_back_board(config):
+    return get_outline(config), []
 
-def get_front_board():
-    title = compose(
-        text("Caminhos   ", scale=1, translate=(total_width/2, .4 * total_height)),
-        text("   Malucos", scale=1, translate=(total_width/2,  .6 * total_height)),
-    )
+@stage("title")
+def get_front_board(config):
+    total_width, total_height = config.total_width, config.total_height
+    # Title lines are .2 of the height apart, around the center
+    title = compose([
+        text(line, scale=1, translate=(total_width/2, (.5 + .2 * (i - (len(config.title) - 1) / 2)) * total_height))
+        for i, line in enumerate(config.title)
+    ])
 
-    signature = text("Tio Paulo - Junho/2019", scale=.2, translate=(total_width - handle_size - 2 * piece_spacing, total_height - 2 * piece_spacing), align=-1, valign=-1)
+    signature = text(config.signature, scale=.2, translate=(total_width - config.handle_size - 2 * config.piece_spacing, total_height - 2 * config.piece_spacing), align=-1, valign=-1)
 
-    return get_outline(border=False), compose(title, signature)
+    return get_outline(config, border=False), compose(title, signature)
 
 
-def main():
+# `params` overrides the default board parameters, see `BoardConfig`, and `links` (if given) the
+# tiles dealt from `seed` with the `tiles` policy
+Board = collections.namedtuple("Board", ["seed", "grid_size", "tiles", "params", "links"], defaults=[None])
+
+def board_config(board):
+    return BoardConfig.make(**{ **board.params, "grid_size": board.grid_size })
+
+def board_links(board):
+    """ Tiles of a board, given explicitly or dealt from its seed """
+    if board.links is not None:
+        return [ tuple(tuple(link) for link in piece_links) for piece_links in board.links ]
+    return get_board_links(board_config(board), board.tiles, random.Random(board.seed))
+
+PARTS = {
+    "main": lambda config, board, executor: get_main_board(config, board_links(board), executor),
+    "back": lambda config, board, executor: get_back_board(config),
+    "front": lambda config, board, executor: get_front_board(config),
+}
+
+@functools.cache
+def source_version():
+    root = pathlib.Path(__file__).parent
+    return code_version(__file__, *root.glob("utils/*.py"), root / "utils" / "hersheydata.npz")
+
+def part_key(name, board):
+    """ Content key for a part, from everything its geometry depends on """
+    inputs = (source_version(), name, stage_parameters(board_config(board), *PART_STAGES[name]))
+    if name == "main":
+        inputs += (board_links(board),)
+    return content_key(*inputs)
+
+def build_part(name, board, cache=None, threads=1):
+    """
+    Builds a part, returning its cuts and engravings as WKB, so they can be sent across processes.
+
+    Parts found in `cache` are not rebuilt. Independent geometry steps run on `threads` threads.
+    """
+    with trace.span(f"part:{name}", cached=0) as s:
+        key = part_key(name, board)
+        if cache is not None and (data := cache.get(key)) is not None:
+            s.set(cached=1)
+            return pickle.loads(data)
+
+        with thread_executor(threads) as executor:
+            cuts, engravings = PARTS[name](board_config(board), board, executor)
+        part = shapely.to_wkb(compose(cuts)), shapely.to_wkb(compose(engravings))
+
+        if cache is not None:
+            cache.put(key, pickle.dumps(part))
+        return part
+
+def layout_parts(parts, config):
+    """ Adds the "all" part, with every other part side by side, and returns the size of each part """
     all_cuts = []
     all_engravings = []
+    x_offset = 0
+    for name, (cuts, engravings) in parts.items():
+        all_cuts.append(translate(shapely.from_wkb(cuts), xoff=x_offset))
+        all_engravings.append(translate(shapely.from_wkb(engravings), xoff=x_offset))
+        x_offset += config.total_width
 
-    parts = {
-        "main": get_main_board(),
-        "back": get_back_board(),
-        "front": get_front_board(),
-        "all": (all_cuts, all_engravings)
-    }
+    sizes = { name: (config.total_width, config.total_height) for name in parts }
+    parts["all"] = shapely.to_wkb(compose(all_cuts)), shapely.to_wkb(compose(all_engravings))
+    sizes["all"] = (x_offset, config.total_height)
+    return sizes
 
-    x_offset = 0
+def cut_paths(cuts, name):
+    """ Cut strokes, without duplicates and ordered for the laser """
+    # Everything inside a part is cut before its outline, so it doesn't drop out early
+    return toolpath.optimize(strokes.deduplicate(cuts.boundary, name=name), nested=True, containers=cuts, name=name)
+
+def engraving_paths(engravings, name):
+    """ Engraving strokes, without duplicates and ordered for the laser """
+    return toolpath.optimize(strokes.deduplicate(engravings, name=name), name=name)
+
+# Strokes of each layer, and which geometry they are made from: 0 for cuts, 1 for engravings
+STROKES = {
+    "cut": (cut_paths, 0),
+    "engraving": (engraving_paths, 1),
+}
+
+@functools.lru_cache(maxsize = 16)
+def part_strokes(layer, geometry, name):
+    """
+    Strokes of a `layer` of a part (given as WKB), which all files with that layer share.
+
+    They are kept by geometry, so a rebuild that leaves a layer unchanged (e.g. `--watch`) reuses them.
+    """
+    paths, _ = STROKES[layer]
+    # Kept as geometries rather than WKB, which would turn closed rings into open lines
+    return tuple(paths(shapely.from_wkb(geometry), name))
+
+def laser_layers(paths, laser):
+    """ Engravings go first, while the part is still held in place """
+    return [
+        (layer, laser.profiles[layer], (shapely.get_coordinates(path) for path in paths[layer]))
+        for layer in ("engraving", "cut")
+    ]
+
+def write_cut(filename, width, height, cuts, engravings, paths, laser):
+    with SVGWriter(filename, width, height, arc_tolerance=laser.arc_tolerance) as svg:
+        svg.stroke(paths["cut"], color=(0, 0, 0), line_width=.1)
+    svg.reduction.log(logging.getLogger("arcs"), os.path.basename(filename))
+
+def write_engraving(filename, width, height, cuts, engravings, paths, laser):
+    with SVGWriter(filename, width, height, arc_tolerance=laser.arc_tolerance) as svg:
+        svg.stroke(paths["engraving"], color=(0, 0, 1), line_width=.2)
+    svg.reduction.log(logging.getLogger("arcs"), os.path.basename(filename))
+
+def write_gcode(filename, width, height, cuts, engravings, paths, laser):
+    layers = laser_layers(paths, laser)
+    reduction = arcs.Reduction() if laser.arc_tolerance is not None else None
+    gcode.write_job(filename, gcode.gcode_lines(layers, height, laser.max_power, laser.arc_tolerance, reduction=reduction))
+    if reduction is not None:
+        reduction.log(logging.getLogger("arcs"), os.path.basename(filename))
+
+def write_hpgl(filename, width, height, cuts, engravings, paths, laser):
+    layers = laser_layers(paths, laser)
+    gcode.write_job(filename, gcode.hpgl_lines(layers, height))
+
+def write_preview(filename, width, height, cuts, engravings, paths, laser):
+    # Only the preview needs a full renderer
+    import cairo
+
+    with cairo.SVGSurface(filename, width, height) as surface:
+        surface.set_document_unit(cairo.SVGUnit.MM)
+        context = cairo.Context(surface)
+        with trace.span("outline_union"):
+            outlines = unary_union(cuts.boundary)
+        with trace.span("cairo"):
+            raster.draw_preview(context, cuts, outlines, engravings)
+
+OUTPUTS = {
+    "preview": write_preview,
+    "cut": write_cut,
+    "engraving": write_engraving,
+    "gcode": write_gcode,
+    "hpgl": write_hpgl,
+}
+
+DEFAULT_OUTPUTS = ["preview", "cut", "engraving"]
+
+OUTPUT_EXTENSIONS = {
+    "preview": "svg",
+    "cut": "svg",
+    "engraving": "svg",
+    "gcode": "gcode",
+    "hpgl": "plt",
+}
+
+# Which geometry each output is rendered from: 0 for cuts, 1 for engravings
+OUTPUT_SOURCES = {
+    "preview": (0, 1),
+    "cut": (0,),
+    "engraving": (1,),
+    "gcode": (0, 1),
+    "hpgl": (0, 1),
+}
+
+# Which strokes each output draws, see `STROKES`
+OUTPUT_STROKES = {
+    "preview": (),
+    "cut": ("cut",),
+    "engraving": ("engraving",),
+    "gcode": ("engraving", "cut"),
+    "hpgl": ("engraving", "cut"),
+}
+
+# Outputs that depend on the laser settings
+LASER_OUTPUTS = {"gcode", "hpgl"}
+
+# Outputs that only depend on the arc tolerance of the laser settings
+ARC_OUTPUTS = {"cut", "engraving"}
+
+def render_file(output, filename, width, height, cuts, engravings, paths, laser):
+    """ Writes an output file of a part, from its geometry (given as WKB) and the `paths` of its strokes """
+    with trace.span(f"render:{output}", file=os.path.basename(filename)) as s:
+        OUTPUTS[output](filename, width, height, shapely.from_wkb(cuts), shapely.from_wkb(engravings), paths, laser)
+        s.set(bytes=os.path.getsize(filename))
+
+
+def raster_filenames(name, size, settings):
+    filenames = [ f"{name}-preview-{dpi:g}dpi.png" for dpi in settings.dpis ]
+    if settings.mipmaps:
+        levels = raster.mipmap_levels(*raster.pixel_size(*size, max(settings.dpis)))
+        filenames += [ f"{name}-mipmap-{level}.png" for level in range(levels) ]
+    return filenames
+
+def render_raster(executor, name, size, cuts, engravings, output_dir, settings, cache=None):
+    """
+    Renders the PNG previews of a part, at every resolution in `settings`, and optionally its mipmaps.
+
+    The part is only drawn at the largest resolution, by tiles on `executor`, and that render is kept in
+    `cache`: other resolutions, now or on later runs, are scaled down from the smallest cached render
+    that is large enough.
+    """
+    logger = logging.getLogger("raster")
+    start = time.perf_counter()
+    dpi = max(settings.dpis)
+    geometry_key = content_key(source_version(), "raster", size, hashlib.sha256(cuts).hexdigest(), hashlib.sha256(engravings).hexdigest())
+
+    rendered = json.loads(cache.get(geometry_key) or "[]") if cache is not None else []
+    pixels = None
+    if larger := [ rendered_dpi for rendered_dpi in rendered if rendered_dpi >= dpi ]:
+        if (data := cache.get(content_key(geometry_key, min(larger)))) is not None:
+            pixels = raster.resize(raster.from_png(data), *raster.pixel_size(*size, dpi))
+    if pixels is None:
+        pixels = raster.render(executor, cuts, engravings, *size, dpi, settings.tile_size)
+        if cache is not None:
+            cache.put(content_key(geometry_key, dpi), raster.to_png(pixels))
+            cache.put(geometry_key, json.dumps(sorted({ *rendered, dpi })).encode())
+        logger.info(f"{name}: rendered {pixels.shape[1]}x{pixels.shape[0]}px in {time.perf_counter() - start:.2f}s")
+
+    images = [ raster.resize(pixels, *raster.pixel_size(*size, file_dpi)) for file_dpi in settings.dpis ]
+    if settings.mipmaps:
+        images += raster.mipmaps(pixels)
+    for filename, image in zip(raster_filenames(name, size, settings), images):
+        pathlib.Path(output_dir, filename).write_bytes(raster.to_png(image))
+
+def render_parts(executor, parts, sizes, outputs, output_dir, laser=gcode.LaserSettings(), rasters=None, cache=None):
+    """
+    Renders the output files of all parts into `output_dir`, and their PNG previews, with `rasters` settings.
+
+    Files are skipped if the manifest in `output_dir` says they were already rendered from the same geometry.
+    """
+    manifest_path = pathlib.Path(output_dir, ".manifest.json")
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    renders = []
+    # Strokes are deduplicated and ordered once per part, for all the files that draw them
+    strokes = {}
+    stroke_renders = []
     for name, (cuts, engravings) in parts.items():
-        cuts = compose(cuts)
-        engravings = compose(engravings)
+        digests = hashlib.sha256(cuts).hexdigest(), hashlib.sha256(engravings).hexdigest()
+        for output in outputs:
+            filename = f"{name}-{output}.{OUTPUT_EXTENSIONS[output]}"
+            key = content_key(
+                source_version(), output, sizes[name], *(digests[i] for i in OUTPUT_SOURCES[output]),
+                *([laser] if output in LASER_OUTPUTS else [laser.arc_tolerance] if output in ARC_OUTPUTS else []))
+            if manifest.get(filename) == key and pathlib.Path(output_dir, filename).exists():
+                continue
+
+            manifest.pop(filename, None)
+            if not OUTPUT_STROKES[output]:
+                renders.append((filename, key, executor.submit(
+                    render_file, output, f"{output_dir}/{filename}", *sizes[name], cuts, engravings, {}, laser)))
+                continue
+            for layer in OUTPUT_STROKES[output]:
+                if (name, layer) not in strokes:
+                    strokes[name, layer] = executor.submit(part_strokes, layer, parts[name][STROKES[layer][1]], name)
+            stroke_renders.append((name, output, filename, key))
+
+    # Vector files render in the background meanwhile
+    rendered_rasters = []
+    if rasters is not None:
+        for name, (cuts, engravings) in parts.items():
+            filenames = raster_filenames(name, sizes[name], rasters)
+            key = content_key(
+                source_version(), "png", sizes[name], rasters,
+                hashlib.sha256(cuts).hexdigest(), hashlib.sha256(engravings).hexdigest())
+            if all(manifest.get(filename) == key and pathlib.Path(output_dir, filename).exists() for filename in filenames):
+                continue
+
+            for filename in filenames:
+                manifest.pop(filename, None)
+            render_raster(executor, name, sizes[name], cuts, engravings, output_dir, rasters, cache)
+            rendered_rasters += [(filename, key) for filename in filenames]
+
+    for name, output, filename, key in stroke_renders:
+        paths = { layer: strokes[name, layer].result() for layer in OUTPUT_STROKES[output] }
+        renders.append((filename, key, executor.submit(
+            render_file, output, f"{output_dir}/{filename}", *sizes[name], *parts[name], paths, laser)))
+
+    for filename, key, render in renders:
+        render.result()
+        manifest[filename] = key
+    manifest.update(rendered_rasters)
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    return [filename for filename, _, _ in renders] + [filename for filename, _ in rendered_rasters]
+
+def build_board(board, outputs, output_dir=None, cache=None, laser=gcode.LaserSettings(), threads=1, rasters=None):
+    """
+    Builds and renders all files of a board, in this process (on `threads` threads).
 
-        svg_width = total_width
-        svg_height = total_height
+    Files are written to `output_dir`, returning the names of the files that had to be rendered,
+    or returned as a `{filename: content}` dict if there is no `output_dir`.
+    """
+    if output_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            build_board(board, outputs, tmp_dir, cache, laser, threads, rasters)
+            return {
+                filename: pathlib.Path(tmp_dir, filename).read_bytes()
+                for filename in sorted(os.listdir(tmp_dir))
+                if not filename.startswith(".")
+            }
 
-        if name == "all":
-            svg_width = x_offset
+    os.makedirs(output_dir, exist_ok=True)
+    with open(f"{output_dir}/board.json", "w") as f:
+        json.dump(board._asdict(), f)
+
+    parts = { name: build_part(name, board, cache, threads) for name in PARTS }
+    sizes = layout_parts(parts, board_config(board))
+    return render_parts(SerialExecutor(), parts, sizes, outputs, output_dir, laser, rasters, cache)
+
+def build_batch(executor, boards, outputs, output_dir, archive=None, cache=None, laser=gcode.LaserSettings(), threads=1, rasters=None):
+    """
+    Builds many boards, one per worker task, each into its own numbered directory.
+
+    Workers keep their caches between boards, so geometry shared by boards of the same size
+    (outline, holes, slots, connection paths, tile templates) is only built once per worker.
+    """
+    if archive is None:
+        output_dirs = [f"{output_dir}/{i:05d}" for i in range(len(boards))]
+        for _ in executor.map(build_board, boards, itertools.repeat(outputs), output_dirs, itertools.repeat(cache), itertools.repeat(laser), itertools.repeat(threads), itertools.repeat(rasters), chunksize=1):
+            pass
+        return
+
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for i, files in enumerate(executor.map(build_board, boards, itertools.repeat(outputs), itertools.repeat(None), itertools.repeat(cache), itertools.repeat(laser), itertools.repeat(threads), itertools.repeat(rasters), chunksize=1)):
+            for filename, content in files.items():
+                zip_file.writestr(f"{i:05d}/{filename}", content)
+
+def build_sheets(executor, boards, outputs, output_dir, sheet_size, spacing, refine=False, cache=None, laser=gcode.LaserSettings(), threads=1, rasters=None):
+    """
+    Builds the parts of many boards and nests them onto sheets, rendering one combined job per sheet.
+
+    Parts are packed by their bounding boxes, and with `refine`, moved closer by their actual outlines.
+    """
+    log = logging.getLogger("nesting")
+    jobs = [ (name, board) for board in boards for name in PARTS ]
+    built = list(executor.map(build_part, *zip(*jobs), itertools.repeat(cache), itertools.repeat(threads)))
+
+    start = time.perf_counter()
+    cuts = [ shapely.from_wkb(part_cuts) for part_cuts, _ in built ]
+    engravings = [ shapely.from_wkb(part_engravings) for _, part_engravings in built ]
+    footprints = [ nesting.footprint(part_cuts) for part_cuts in cuts ]
+    placements, sheet_count = nesting.nest(footprints, *sheet_size, spacing, polygon_refinement=refine)
+
+    sheet_cuts = [ [] for _ in range(sheet_count) ]
+    sheet_engravings = [ [] for _ in range(sheet_count) ]
+    for footprint, part_cuts, part_engravings, placement in zip(footprints, cuts, engravings, placements):
+        bounds = footprint.bounds
+        sheet_cuts[placement.sheet].append(nesting.transform(part_cuts, bounds, placement))
+        sheet_engravings[placement.sheet].append(nesting.transform(part_engravings, bounds, placement))
+
+    used_area = sum(footprint.area for footprint in footprints)
+    log.info(
+        "Nested %d parts of %d boards onto %d sheets of %gx%gmm (%.1f%% used) in %.2fs",
+        len(jobs), len(boards), sheet_count, *sheet_size,
+        100 * used_area / (sheet_count * sheet_size[0] * sheet_size[1]), time.perf_counter() - start)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(f"{output_dir}/sheets.json", "w") as f:
+        json.dump([
+            dict(board=board._asdict(), part=name, **placement._asdict())
+            for (name, board), placement in zip(jobs, placements)
+        ], f, indent=2)
+
+    sheets = {
+        f"sheet-{i:02d}": (shapely.to_wkb(compose(sheet_cuts[i])), shapely.to_wkb(compose(sheet_engravings[i])))
+        for i in range(sheet_count)
+    }
+    sizes = { name: tuple(sheet_size) for name in sheets }
+    return render_parts(executor, sheets, sizes, outputs, output_dir, laser, rasters, cache)
+
+def load_parameters(filename):
+    if filename is None:
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+def analyze_tiles(boards, games, players=2, jobs=None, report_file=None):
+    """ Plays random Tsuro games with the tiles of each board, logging how balanced each tile set is """
+    log = logging.getLogger("analyze")
+    reports = []
+    for board in boards:
+        links = board_links(board)
+
+        start = time.perf_counter()
+        stats = tsuro.analyze(links, games, board.grid_size, players, seed=board.seed, jobs=jobs)
+        report = dict(tiles_policy=board.tiles, grid_size=board.grid_size, players=players, seed=board.seed, **stats.report())
+        for tile_links, tile_report in zip(links, report["tiles"]):
+            tile_report["links"] = tile_links
+        reports.append(report)
+
+        log.info(
+            "%s tiles, %dx%d, %d players: %d games in %.1fs, mean path length %.2f, elimination rate %.3f, "
+            "loops per placement %.4f, decided by edge exits %.3f",
+            board.tiles, board.grid_size, board.grid_size, players, games, time.perf_counter() - start,
+            report["mean_path_length"], report["elimination_rate"], report["loops_per_placement"], report["decided_by_edge"])
+        for i, tile_report in enumerate(report["tiles"]):
+            log.info("  tile %2d %-32s placements %8d, eliminations per placement %.3f",
+                i, tile_report["links"], tile_report["placements"], tile_report["eliminations_per_placement"])
+
+    if report_file is not None:
+        with open(report_file, "w") as f:
+            json.dump(reports, f, indent=2)
+
+def watch(params_file, make_board, outputs, output_dir, cache, laser=gcode.LaserSettings(), threads=1, rasters=None):
+    """
+    Rebuilds the board whenever the parameters file changes.
+
+    Everything is built in this process, so the stages not affected by the change stay cached in memory,
+    and only the output files whose content changed are rewritten.
+    """
+    logger = logging.getLogger("watch")
+    last_mtime = None
+    last_stages = {}
+
+    while True:
+        try:
+            mtime = os.stat(params_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime != last_mtime:
+            last_mtime = mtime
+            try:
+                start = time.perf_counter()
+                board = make_board(load_parameters(params_file))
+
+                config = board_config(board)
+                stages = { name: stage_parameters(config, name) for name in STAGES }
+                changed = [ name for name in STAGES if stages[name] != last_stages.get(name) ]
+                last_stages = stages
+
+                rendered = build_board(board, outputs, output_dir, cache, laser, threads, rasters)
+                logger.info(
+                    f"Rebuilt stages [{', '.join(changed)}] and rendered [{', '.join(rendered)}] "
+                    f"in {time.perf_counter() - start:.2f}s")
+            except Exception:
+                logger.exception(f"Failed to build from {params_file}")
+
+        time.sleep(.2)
+
+def request_board(request, default_board):
+    """ Board of a server request, with whatever the request doesn't give taken from `default_board` """
+    request_params = request.get("params", {})
+    board = Board(
+        request.get("seed", default_board.seed),
+        request.get("grid_size", request_params.get("grid_size", default_board.grid_size)),
+        request.get("tiles", default_board.tiles),
+        { **default_board.params, **request_params },
+        request.get("links"))
+
+    if board.tiles not in TILE_POLICIES:
+        raise ValueError(f"Unknown tile policy: {board.tiles}")
+    if board.links is not None:
+        if len(board.links) != board.grid_size ** 2:
+            raise ValueError(f"A {board.grid_size}x{board.grid_size} board needs {board.grid_size ** 2} tiles, got {len(board.links)}")
+        for piece_links in board.links:
+            if tiles.normalize_tile(piece_links) not in tiles.TILE_INDEX:
+                raise ValueError(f"Not a tile: {piece_links}")
+    return board
+
+def render_request(request, default_board, outputs, laser=gcode.LaserSettings(), cache=None, threads=1):
+    """
+    Builds and renders the board of a server request, returning the content of its files.
+
+    A request can give the board's `seed`, `grid_size`, `tiles`, `params` and `links` (see `Board`),
+    and the `parts` and `outputs` to render. Anything it doesn't give is taken from `default_board`
+    and `outputs`.
+    """
+    start = time.perf_counter()
+    board = request_board(request, default_board)
+    names = request.get("parts", [*PARTS, "all"])
+    outputs = request.get("outputs", outputs)
+    if unknown := set(names) - set(PARTS) - {"all"}:
+        raise ValueError(f"Unknown parts: {', '.join(sorted(unknown))}")
+    if unknown := set(outputs) - set(OUTPUTS):
+        raise ValueError(f"Unknown outputs: {', '.join(sorted(unknown))}")
+
+    parts = { name: build_part(name, board, cache, threads) for name in PARTS if name in names or "all" in names }
+    sizes = layout_parts(parts, board_config(board))
+    built = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        render_parts(SerialExecutor(), { name: parts[name] for name in names }, sizes, outputs, tmp_dir, laser)
+        files = {
+            filename: pathlib.Path(tmp_dir, filename).read_text()
+            for filename in sorted(os.listdir(tmp_dir))
+            if not filename.startswith(".")
+        }
+
+    return dict(
+        board=board._asdict(), files=files,
+        timings=dict(build=built - start, render=time.perf_counter() - built))
+
+def serve(socket_path, workers, default_board, outputs, cache, laser=gcode.LaserSettings(), threads=1):
+    """
+    Serves render requests (see `render_request`) as JSON lines, on stdin/stdout if `socket_path` is "-",
+    or else on a Unix socket.
+
+    Fonts, tile templates and the geometry shared by boards of the same size stay cached in memory
+    between requests, which are handled by up to `workers` threads at once.
+    """
+    logger = logging.getLogger("server")
+
+    # Build the default board once, loading everything most boards share
+    start = time.perf_counter()
+    for name in PARTS:
+        build_part(name, default_board, threads=threads)
+    logger.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+    handler = functools.partial(render_request, default_board=default_board, outputs=outputs, laser=laser, cache=cache, threads=threads)
+    with RequestServer(handler, workers) as server:
+        if socket_path == "-":
+            server.serve_stream(sys.stdin, sys.stdout)
         else:
-            all_cuts.append(translate(cuts, xoff=x_offset))
-            all_engravings.append(translate(engravings, xoff=x_offset))
-            x_offset += total_width
+            server.serve_socket(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the laser cutting files for the board")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of worker processes (default: one per CPU)")
+    parser.add_argument("--threads", type=int, default=1, help="Threads building the independent geometry steps of each part (default: 1)")
+    parser.add_argument("--seed", type=int, help="Seed for the randomly generated pieces (first seed, on batches)")
+    parser.add_argument("-o", "--output-dir", default="out", help="Directory for the output files")
+    parser.add_argument("--grid-size", type=int, nargs="+", help="Grid size (on batches, boards cycle through all given sizes)")
+    parser.add_argument("--tiles", choices=TILE_POLICIES, nargs="+", default=["default"], help="Tile set policy (on batches, boards cycle through all given policies)")
+    parser.add_argument("--outputs", choices=OUTPUTS, nargs="+", default=DEFAULT_OUTPUTS, help=f"Files to generate for each part (default: {' '.join(DEFAULT_OUTPUTS)})")
+    parser.add_argument("--laser", metavar="FILE", help="JSON file with laser settings for gcode and hpgl outputs (e.g. {\"arc_tolerance\": .01, \"cut\": {\"power\": 80, \"speed\": 300, \"passes\": 2}})")
+    parser.add_argument("--arcs", type=float, nargs="?", const=DEFAULT_TOLERANCE, metavar="TOLERANCE", help=f"Output curves in the cut, engraving and gcode files as arcs, within TOLERANCE mm (default: {DEFAULT_TOLERANCE}mm)")
+    parser.add_argument("--png", type=float, nargs="+", metavar="DPI", help="Also render PNG previews of each part at these resolutions")
+    parser.add_argument("--mipmaps", action="store_true", help="With --png, also write the mipmap pyramid of the largest preview, down to 1x1")
+    parser.add_argument("--tile-size", type=int, default=512, metavar="PX", help="With --png, size of the tiles rendered in parallel (default: 512px)")
+    parser.add_argument("--batch", type=int, metavar="N", help="Generate N boards, each into its own directory")
+    parser.add_argument("--sheet", type=float, nargs=2, metavar=("WIDTH", "HEIGHT"), help="Nest the parts of all boards (one, or --batch N) onto sheets of this size, in mm, with one job per sheet")
+    parser.add_argument("--sheet-spacing", type=float, default=3, metavar="MM", help="Spacing between nested parts and the sheet edges (default: 3mm)")
+    parser.add_argument("--refine", action="store_true", help="With --sheet, move nested parts closer together by their actual outlines")
+    parser.add_argument("--archive", help="On batches, write all boards into this zip file instead of the output directory")
+    parser.add_argument("--cache-dir", help=f"Directory for the build cache (default: {default_cache_dir()})")
+    parser.add_argument("--cache-size", type=int, default=512, metavar="MB", help="Maximum size of the build cache (default: 512MB)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the build cache")
+    parser.add_argument("--params", metavar="FILE", help="JSON file with board parameters overriding the defaults (e.g. {\"piece_arc\": 8})")
+    parser.add_argument("--watch", action="store_true", help="Keep running, rebuilding the board whenever the --params file changes")
+    parser.add_argument("--serve", nargs="?", const="-", metavar="SOCKET", help="Keep running, rendering boards for JSON-lines requests on stdin/stdout, or on the Unix socket SOCKET")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="With --serve, requests handled at once (default: one per CPU)")
+    parser.add_argument("--trace", metavar="FILE", default=os.environ.get(trace.ENV), help=f"Time each build stage and geometry step, logging a summary and writing a Chrome trace (for Perfetto) to FILE (default: ${trace.ENV})")
+    parser.add_argument("--analyze", type=int, metavar="GAMES", help="Instead of building, play GAMES random Tsuro games with each tile set and report how balanced it is")
+    parser.add_argument("--players", type=int, default=2, help="Players per game, with --analyze")
+    parser.add_argument("--report", metavar="FILE", help="With --analyze, also write the full report to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.trace:
+        trace.start()
+        atexit.register(trace.finish, args.trace)
+
+    cache = None if args.no_cache else BuildCache(args.cache_dir, max_size=args.cache_size << 20)
+    laser = gcode.load_settings(load_parameters(args.laser))
+    if args.arcs is not None:
+        laser = laser._replace(arc_tolerance=args.arcs)
+    rasters = raster.RasterSettings(tuple(args.png), args.mipmaps, args.tile_size) if args.png else None
+
+    # Every part gets the same seed, so the result doesn't depend on which worker builds it
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+
+    def make_board(params, index=0):
+        grid_sizes = args.grid_size or [params.get("grid_size", BASE_PARAMETERS["grid_size"])]
+        return Board(seed + index, grid_sizes[index % len(grid_sizes)], args.tiles[index % len(args.tiles)], params)
 
+    if args.watch:
+        if args.params is None:
+            parser.error("--watch needs a --params file")
+        watch(args.params, make_board, args.outputs, args.output_dir, cache, laser, args.threads, rasters)
 
-        with cairo.SVGSurface(f"out/{name}-preview.svg", svg_width, svg_height) as surface:
-            surface.set_document_unit(cairo.SVGUnit.MM)
-            context = cairo.Context(surface)
+    params = load_parameters(args.params)
 
-            draw_shape(context, cuts)
-            context.set_source_rgb(.82, .71, .55)
-            context.fill()
+    if args.serve is not None:
+        serve(args.serve, args.workers, make_board(params), args.outputs, cache, laser, args.threads)
+        return
 
-            draw_shape(context, unary_union(cuts.boundary))
-            context.set_source_rgb(0, 0, 0)
-            context.set_line_width(.2)
-            context.stroke()
+    if args.analyze is not None:
+        boards = [make_board(params, i) for i in range(max(len(args.tiles), len(args.grid_size or [])))]
+        analyze_tiles(boards, args.analyze, args.players, args.jobs, args.report)
+        return
 
-            draw_shape(context, engravings)
-            context.set_source_rgb(0.23, 0.13, 0.06)
-            context.set_line_width(.2)
-            context.stroke()
+    with process_executor(args.jobs) as executor:
+        if args.sheet is not None:
+            boards = [make_board(params, i) for i in range(args.batch or 1)]
+            build_sheets(executor, boards, args.outputs, args.output_dir, args.sheet, args.sheet_spacing, args.refine, cache, laser, args.threads, rasters)
+            return
 
-        with cairo.SVGSurface(f"out/{name}-cut.svg", svg_width, svg_height) as surface:
-            surface.set_document_unit(cairo.SVGUnit.MM)
-            context = cairo.Context(surface)
+        if args.batch is not None:
+            boards = [make_board(params, i) for i in range(args.batch)]
+            build_batch(executor, boards, args.outputs, args.output_dir, args.archive, cache, laser, args.threads, rasters)
+            return
 
-            draw_shape(context, unary_union(cuts.boundary))
-            context.set_source_rgba(0, 0, 0, 1)
-            context.set_line_width(.1)
-            context.stroke()
+        board = make_board(params)
+        os.makedirs(args.output_dir, exist_ok=True)
 
-        with cairo.SVGSurface(f"out/{name}-engraving.svg", svg_width, svg_height) as surface:
-            surface.set_document_unit(cairo.SVGUnit.MM)
-            context = cairo.Context(surface)
+        parts = dict(zip(PARTS, executor.map(build_part, PARTS, itertools.repeat(board), itertools.repeat(cache), itertools.repeat(args.threads))))
+        sizes = layout_parts(parts, board_config(board))
 
-            draw_shape(context, engravings)
-            context.set_source_rgba(0, 0, 1, 1)
-            context.set_line_width(.2)
-            context.stroke()
+        render_parts(executor, parts, sizes, args.outputs, args.output_dir, laser, rasters, cache)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import concurrent.futures
+import os
+import pickle
+
+from utils.cache import BuildCache, content_key
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = BuildCache(tmp_path, max_size=3000)
+    keys = [content_key(i) for i in range(5)]
+    for age, key in enumerate(keys[:3]):
+        cache.put(key, b"x" * 1000)
+        os.utime(cache._path(key), (age, age))
+    cache.get(keys[0])
+    cache.put(keys[3], b"x" * 1000)
+
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in (keys[0], keys[2], keys[3]))
+
+def test_counts_existing_entries_and_overwrites(tmp_path):
+    for i in range(3):
+        BuildCache(tmp_path).put(content_key(i), b"x" * 1000)
+
+    cache = BuildCache(tmp_path, max_size=3500)
+    for _ in range(5):
+        cache.put(content_key(0), b"x" * 1000)
+    assert all(cache.get(content_key(i)) is not None for i in range(3))
+
+    cache.put(content_key(3), b"x" * 1000)
+    assert sum(cache.get(content_key(i)) is not None for i in range(4)) == 3
+
+def test_shared_by_threads(tmp_path):
+    cache = BuildCache(tmp_path, max_size=50_000)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: cache.put(content_key(i % 150), b"x" * 1000), range(600)))
+
+    sizes = [path.stat().st_size for path in tmp_path.glob("??/*")]
+    assert cache._size == sum(sizes) <= 50_000
+
+def test_pickles_without_its_lock(tmp_path):
+    cache = BuildCache(tmp_path, max_size=3000)
+    cache.put(content_key(0), b"x" * 1000)
+
+    copy = pickle.loads(pickle.dumps(cache))
+    assert (copy.directory, copy.max_size) == (cache.directory, cache.max_size)
+    assert copy.get(content_key(0)) == b"x" * 1000
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import shapely
+
+from utils.geom import bernstein_basis, bezier_batch
+
+@pytest.mark.parametrize("tolerance", [.05, .1, .5])
+def test_adaptive_flattening_is_within_tolerance_and_smaller(tolerance):
+    controls = np.random.default_rng(1234).uniform(0, 40, (200, 4, 2))
+    adaptive = bezier_batch(controls, tolerance=tolerance, adaptive=True)
+    uniform = bezier_batch(controls, tolerance=tolerance)
+
+    curves = shapely.linestrings(np.einsum("ij,cjd->cid", bernstein_basis(3, 2000), controls))
+    assert shapely.hausdorff_distance(adaptive, curves).max() <= tolerance
+    assert shapely.get_num_coordinates(adaptive).sum() < shapely.get_num_coordinates(uniform).sum()
+
+    # Curves start and end exactly on their end points, so they join up with whatever they connect to
+    ends = np.array([(line.coords[0], line.coords[-1]) for line in adaptive])
+    assert (ends == controls[:, [0, -1]]).all()
+
+def test_adaptive_flattening_is_symmetric():
+    # Links of reflected tiles are drawn backwards, their offsets must still match
+    controls = np.random.default_rng(1234).uniform(0, 40, (200, 4, 2))
+    forward = bezier_batch(controls, adaptive=True)
+    backward = bezier_batch(controls[:, ::-1], adaptive=True)
+    assert shapely.hausdorff_distance(forward, backward).max() < 1e-9
@@ -0,0 +1,25 @@
+import random
+
+import shapely
+from shapely.ops import linemerge
+
+import crazy_paths
+
+def test_piece_offsets_match_global_buffer():
+    config = crazy_paths.BoardConfig.make()
+    links = crazy_paths.get_board_links(config, "random", random.Random(1234))
+    pieces = [
+        (piece_x, piece_y, piece_links)
+        for (piece_x, piece_y), piece_links in zip(crazy_paths.enum_pieces(config), links)
+    ]
+
+    # The offsets used to be buffered from all the paths of the board at once
+    paths = list(crazy_paths.connection_paths(config))
+    for piece_x, piece_y, piece_links in pieces:
+        paths += crazy_paths.piece_paths(piece_x, piece_y, piece_links, config.entry_distance, config.adaptive_flattening)
+    paths = linemerge(paths)
+
+    offsets = crazy_paths.path_offsets(config, pieces)
+    assert len(offsets) == len(config.parallel_distances)
+    for distance, offset in zip(config.parallel_distances, offsets):
+        assert shapely.hausdorff_distance(offset, paths.buffer(distance).boundary) < .02
@@ -0,0 +1,20 @@
+import random
+
+import pytest
+import shapely
+from shapely.ops import linemerge
+
+import crazy_paths
+
+@pytest.mark.parametrize("params", [{}, {"adaptive_flattening": False}, {"piece_size": 37, "piece_spacing": 2.7}])
+def test_piece_paths_merge_with_connection_paths(params):
+    config = crazy_paths.BoardConfig.make(**params)
+    links = crazy_paths.get_board_links(config, "random", random.Random(1234))
+
+    paths = list(crazy_paths.connection_paths(config))
+    for (piece_x, piece_y), piece_links in zip(crazy_paths.enum_pieces(config), links):
+        paths += crazy_paths.piece_paths(piece_x, piece_y, piece_links, config.entry_distance, config.adaptive_flattening)
+    lines = shapely.get_parts(linemerge(paths))
+
+    # Every path that isn't a loop runs between two of the 8 * grid_size entries on the board edges
+    assert sum(not line.is_closed for line in lines) == 4 * config.grid_size
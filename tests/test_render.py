@@ -0,0 +1,22 @@
+import shapely
+
+import crazy_paths
+from utils import strokes
+from utils.parallel import SerialExecutor
+
+def test_strokes_are_shared_by_all_files(tmp_path, monkeypatch):
+    config = crazy_paths.BoardConfig.make()
+    cuts, engravings = crazy_paths.get_front_board(config)
+    parts = { "front": (shapely.to_wkb(cuts), shapely.to_wkb(engravings)) }
+    sizes = { "front": (config.total_width, config.total_height) }
+
+    calls = []
+    deduplicate = strokes.deduplicate
+    monkeypatch.setattr(strokes, "deduplicate", lambda geom, **kwargs: calls.append(geom) or deduplicate(geom, **kwargs))
+    crazy_paths.part_strokes.cache_clear()
+
+    outputs = ["cut", "engraving", "gcode", "hpgl"]
+    rendered = crazy_paths.render_parts(SerialExecutor(), parts, sizes, outputs, tmp_path)
+    assert sorted(rendered) == sorted(f"front-{output}.{crazy_paths.OUTPUT_EXTENSIONS[output]}" for output in outputs)
+    # Once for the cuts and once for the engravings
+    assert len(calls) == 2
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import shapely
+
+from utils import strokes
+
+def test_overlapping_collinear_strokes():
+    first = shapely.LineString([(0, 5), (0, 0), (10, 0)])
+    # Runs along the first from 4 to 10, just within tolerance of it
+    second = shapely.LineString([(4, .01), (14, .01)])
+    # Runs along the second from 12 to 14
+    third = shapely.LineString([(12, 0), (20, 0)])
+
+    kept = strokes.deduplicate(shapely.MultiLineString([first, second, third]), tolerance=.02)
+
+    # 5 + 10 from the first, 10 to 14 from the second, 14 to 20 from the third
+    assert kept.length == pytest.approx(25)
+    # The first stroke is kept whole, vertex for vertex
+    assert kept.covers(first)
+    assert set(first.coords) <= set(map(tuple, shapely.get_coordinates(kept)))
+    assert not kept.intersects(shapely.LineString([(5, .01), (9, .01)]).buffer(1e-3))
+    assert not kept.intersects(shapely.LineString([(12.5, 0), (13.5, 0)]).buffer(1e-3))
+
+def test_dense_nearly_straight_stroke():
+    # Segments much shorter than the tolerance, each almost in line with its neighbours
+    x = np.arange(0, 10, .005)
+    line = shapely.LineString(np.stack([x, .001 * x**2], axis=1))
+
+    segs, _ = strokes.segments(np.array([line]))
+    overlapped, _, _ = strokes.overlaps(segs, tolerance=.02)
+    assert len(overlapped) == 0
+
+    kept = strokes.deduplicate(line, tolerance=.02)
+    assert kept.length == pytest.approx(line.length)
+    assert len(kept.geoms) == 1
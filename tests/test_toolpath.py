@@ -0,0 +1,20 @@
+import numpy as np
+
+from utils import toolpath
+
+def test_overlapping_outlines_in_a_cycle():
+    # Each outline overlaps the next, with the probe of its first segment inside it: every path
+    # waits on another, and the route must still visit them all
+    outlines = [
+        [(-1, 0), (1, 0), (7, 10), (3, 10), (-1, 0)],
+        [(9, 0), (11, 0), (11, -2), (-2, -2), (-2, 2), (8, 1), (9, 0)],
+        [(4, 8), (6, 8), (12, 1), (12, -1), (8, -1), (3, 7), (4, 8)],
+    ]
+    paths = [np.array(outline, dtype=float) for outline in outlines]
+
+    inside, _ = toolpath.nesting(paths)
+    assert sorted(inside.T.tolist()) == [[0, 1], [1, 2], [2, 0]]
+
+    # Far from every path, so the first search radius finds nothing
+    ordered = toolpath.order_paths(paths, origin=(100, 100), nested=True)
+    assert sorted(map(len, ordered)) == sorted(map(len, paths))
@@ -0,0 +1,169 @@
+"""
+Circular arc fitting for flattened curves.
+
+Runs of polyline vertices that lie on a common circle, within a tolerance, are replaced by a single
+arc, which G-code (G2/G3) and SVG (A) can run directly. Arcs also stay within the tolerance of the
+polyline between its vertices, so sparse polylines (e.g. font glyphs) aren't rounded off.
+
+Runs of equal segments turning by equal angles, which is how buffers (and so `rounded()` corners and
+slot circles) flatten circles, are known to be inscribed in a circle, and are output as that exact
+circle without searching.
+"""
+
+import numpy as np
+
+# Arcs flatter than this are left as lines, their centers would be too far away to be precise
+MAX_RADIUS = 1000.
+
+# Fewest polyline segments an arc is fitted to
+MIN_SEGMENTS = 3
+
+# Where chords are checked against the arc, as fractions of their length
+CHORD_SAMPLES = np.array([.25, .5, .75])
+
+# Steepest turn between the segments of a flattened circle, coarser polylines are kept as they are
+MAX_UNIFORM_TURN = np.pi / 16
+
+LINE = 0
+ARC = 1
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+def circle(a, b, c):
+    """ Center and radius of the circle through 3 points, or None if they are (nearly) collinear """
+    ab, ac = b - a, c - a
+    d = 2 * (ab[0] * ac[1] - ab[1] * ac[0])
+    if abs(d) < 1e-12:
+        return None
+    ab2, ac2 = ab @ ab, ac @ ac
+    center = a + np.array([ac[1] * ab2 - ab[1] * ac2, ab[0] * ac2 - ac[0] * ab2]) / d
+    return center, float(np.linalg.norm(a - center))
+
+def _fits(points, tolerance):
+    """ The arc running through all `points` within `tolerance`, as `(center, radius, ccw)`, or None """
+    fit = circle(points[0], points[len(points) // 2], points[-1])
+    if fit is None:
+        return None
+    center, radius = fit
+    if radius > MAX_RADIUS:
+        return None
+
+    # Both the vertices and the arc between them must stay within tolerance of the polyline
+    relative = points - center
+    if np.abs(np.hypot(relative[:, 0], relative[:, 1]) - radius).max() > tolerance:
+        return None
+    # Sparse vertices off the circle can still bend the polyline away from it between them
+    between = points[:-1, None] + (points[1:] - points[:-1])[:, None] * CHORD_SAMPLES[:, None] - center
+    if np.abs(np.hypot(between[..., 0], between[..., 1]) - radius).max() > tolerance:
+        return None
+
+    # The points must go around the center in a single direction, less than a full turn
+    turns = _cross(relative[:-1], relative[1:])
+    if not ((turns > 0).all() or (turns < 0).all()):
+        return None
+    sweep = np.abs(np.arctan2(turns, np.einsum("ij,ij->i", relative[:-1], relative[1:]))).sum()
+    if sweep >= 2 * np.pi - 1e-6:
+        return None
+    return center, radius, bool(turns[0] > 0)
+
+def uniform_runs(coords, precision=1e-6):
+    """
+    Number of segments in the flattened circle starting at each vertex.
+
+    That is, the run of segments of equal length, turning by the same angle at each vertex. Runs
+    going all the way around are cut in half.
+    """
+    deltas = coords[1:] - coords[:-1]
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    turns = np.arctan2(_cross(deltas[:-1], deltas[1:]), np.einsum("ij,ij->i", deltas[:-1], deltas[1:]))
+
+    # Segment k continues a run started before it if it is as long as segment k-1, and turns from it
+    # as segment k-1 turned from segment k-2 (except for a run's second segment)
+    same_length = np.abs(lengths[1:] - lengths[:-1]) <= precision * np.maximum(lengths[1:], lengths[:-1])
+    curved = (turns != 0) & (np.abs(turns) <= MAX_UNIFORM_TURN) & same_length
+    same_turn = np.abs(turns[1:] - turns[:-1]) <= precision
+    continues = np.concatenate([curved[1:] & same_turn, [False]])
+
+    # Length of the streak of continuing segments from each segment on
+    breaks = np.flatnonzero(~continues)
+    streaks = breaks[np.searchsorted(breaks, np.arange(len(continues)))] - np.arange(len(continues))
+
+    runs = np.ones(len(lengths), dtype=int)
+    runs[:-1] += curved
+    runs[:-1] += np.where(curved, streaks, 0)
+    # Full circles are split in halves
+    max_segments = np.floor((2 * np.pi - 1e-6) / np.maximum(np.abs(np.concatenate([turns, [0]])), 1e-12)).astype(int)
+    full = runs > max_segments
+    runs[full] = (max_segments[full] + 1) // 2
+    return runs
+
+def fit_arcs(coords, tolerance=.01):
+    """
+    Splits a polyline into lines and arcs.
+
+    Yields `(LINE, end)` and `(ARC, end, center, ccw)` moves, starting from `coords[0]`. `ccw`
+    is the direction of the arc, in a frame with the y axis pointing up.
+    """
+    coords = np.asarray(coords, dtype=float)
+    n = len(coords)
+    runs = uniform_runs(coords) if n > 2 else np.ones(max(n - 1, 0), dtype=int)
+    i = 0
+    while i < n - 1:
+        # Flattened circles are output as exact arcs
+        if runs[i] >= MIN_SEGMENTS:
+            length = runs[i]
+            fit = circle(coords[i], coords[i + length // 2], coords[i + length])
+            if fit is not None and fit[1] <= MAX_RADIUS:
+                center, _ = fit
+                relative = coords[i:i + 2] - center
+                yield ARC, coords[i + length], center, bool(_cross(relative[0], relative[1]) > 0)
+                i += length
+                continue
+
+        # Grow the arc by doubling, then binary search its furthest end
+        best = None
+        length = MIN_SEGMENTS
+        while i + length < n and (fit := _fits(coords[i:i + length + 1], tolerance)) is not None:
+            best = length, fit
+            length *= 2
+        if best is not None:
+            lo, hi = best[0], min(length, n - i)
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                fit = _fits(coords[i:i + mid + 1], tolerance)
+                if fit is not None:
+                    lo, best = mid, (mid, fit)
+                else:
+                    hi = mid
+            length, (center, radius, ccw) = best
+            yield ARC, coords[i + length], center, ccw
+            i += length
+        else:
+            yield LINE, coords[i + 1]
+            i += 1
+
+def sweep(start, end, center, ccw):
+    """ Angle swept by an arc, in radians, from 0 to 2π """
+    a, b = start - center, end - center
+    angle = np.arctan2(_cross(a, b), a @ b)
+    if ccw:
+        return angle if angle > 0 else angle + 2 * np.pi
+    return -angle if angle < 0 else 2 * np.pi - angle
+
+class Reduction:
+    """ Tally of how much smaller output got with arcs """
+
+    def __init__(self):
+        self.vertices = 0
+        self.moves = 0
+        self.size = 0
+        self.flat_size = 0
+
+    def log(self, log, name):
+        if not self.vertices:
+            return
+        log.info(
+            "%s: %d vertices as %d moves (%.1f%% fewer), %.1fKB instead of %.1fKB (%.1f%% smaller)",
+            name, self.vertices, self.moves, 100 * (1 - self.moves / self.vertices),
+            self.size / 1024, self.flat_size / 1024, 100 * (1 - self.size / max(self.flat_size, 1)))
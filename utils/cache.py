@@ -0,0 +1,108 @@
+"""
+Persistent, content-addressed cache for build artifacts.
+
+Entries are files named after the hash of their inputs. Reading an entry refreshes its mtime, and
+once the cache grows over its size limit the least recently used entries are evicted.
+
+Each `BuildCache` keeps a running total of the cache size, counted once and then updated by its own
+writes, so the directory is only scanned again when that total goes over the limit. Writes by other
+processes are only seen by those scans, which recount everything. Threads can share a `BuildCache`,
+and worker processes get their own copy (with its own count).
+"""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import threading
+
+def default_cache_dir():
+    return pathlib.Path(os.environ.get("XDG_CACHE_HOME", pathlib.Path.home() / ".cache"), "crazy-paths")
+
+def code_version(*paths):
+    """ Hash of the given source files, so cache entries are invalidated whenever the code changes """
+    digest = hashlib.sha256()
+    for path in sorted(map(pathlib.Path, paths)):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+def content_key(*inputs):
+    """ Hash of `inputs`, which must have a stable `repr` (tuples, strings, numbers, ...) """
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+class BuildCache:
+    def __init__(self, directory=None, max_size=512 << 20):
+        self.directory = pathlib.Path(directory or default_cache_dir())
+        self.max_size = max_size
+        # Size of the cache as last counted, plus what was written since (None until first needed)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return { "directory": self.directory, "max_size": self.max_size }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write atomically, other processes may be using the cache
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            try:
+                self._size -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        """ `(mtime, size, path)` of every entry """
+        entries = []
+        for path in self.directory.glob("??/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """ Removes the least recently used entries, until the cache fits in `max_size` """
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+        self._size = total_size
@@ -0,0 +1,122 @@
+"""
+Streaming G-code and HPGL output for laser cutters.
+
+Jobs are made of layers, each run with its own laser profile. Writers are generators yielding one
+line (or HPGL instruction) at a time, so a job is never held in memory as text.
+
+Geometry is in SVG coordinates (y pointing down, in mm), and is flipped into machine coordinates
+(y pointing up, from the bottom left corner of the sheet).
+"""
+
+import collections
+import numpy as np
+
+from . import arcs
+from .svg import format_number
+
+# Power in percent of the maximum, speed in mm/min
+LaserProfile = collections.namedtuple("LaserProfile", ["power", "speed", "passes"], defaults=[1])
+
+DEFAULT_PROFILES = {
+    "engraving": LaserProfile(power=20, speed=3000),
+    "cut": LaserProfile(power=100, speed=400),
+}
+
+# Job-wide settings. `max_power` is the spindle value of full power (GRBL's `$30`), and curves are
+# output as arcs where they fit within `arc_tolerance`, if given
+LaserSettings = collections.namedtuple(
+    "LaserSettings", ["profiles", "max_power", "arc_tolerance"], defaults=[DEFAULT_PROFILES, 1000, None])
+
+# HPGL plotter units per mm
+HPGL_UNITS = 40
+
+def load_settings(overrides=None):
+    """ Laser settings, with defaults overridden by `overrides`, e.g. `{"arc_tolerance": .01, "cut": {"passes": 2}}` """
+    overrides = dict(overrides or {})
+    profiles = dict(DEFAULT_PROFILES)
+    for layer in DEFAULT_PROFILES:
+        profiles[layer] = profiles[layer]._replace(**overrides.pop(layer, {}))
+    return LaserSettings(profiles, **overrides)
+
+def _machine_coords(path, height):
+    path = np.array(path, dtype=float)
+    path[:, 1] = height - path[:, 1]
+    return path
+
+def gcode_lines(layers, height, max_power=1000, arc_tolerance=None, precision=3, reduction=None):
+    """
+    G-code for a job, line by line.
+
+    `layers` is a sequence of `(name, profile, paths)`, where `paths` is an iterable of coordinate
+    arrays. The laser runs in dynamic power mode (M4), and curves are output as G2/G3 arcs if
+    an `arc_tolerance` is given, tallying the savings in `reduction`, an `arcs.Reduction`.
+    """
+    def fmt(value):
+        return format_number(value, precision)
+
+    yield "G21\n"
+    yield "G90\n"
+    yield "M5\n"
+    for name, profile, paths in layers:
+        yield f"; {name}: power {fmt(profile.power)}%, speed {fmt(profile.speed)}mm/min, {profile.passes} passes\n"
+        power = fmt(max_power * profile.power / 100)
+        speed = fmt(profile.speed)
+        yield f"M4 S{power}\n"
+        for path in paths:
+            path = _machine_coords(path, height)
+            for _ in range(profile.passes):
+                yield f"G0 X{fmt(path[0, 0])} Y{fmt(path[0, 1])}\n"
+                # Feed rate and power are modal, they are only set on the first move
+                modal = f" F{speed} S{power}"
+                if arc_tolerance is None:
+                    moves = ((arcs.LINE, point) for point in path[1:])
+                else:
+                    moves = arcs.fit_arcs(path, arc_tolerance)
+                start = path[0]
+                for move in moves:
+                    end = move[1]
+                    if move[0] == arcs.LINE:
+                        line = f"G1 X{fmt(end[0])} Y{fmt(end[1])}{modal}\n"
+                    else:
+                        _, _, center, ccw = move
+                        offset = center - start
+                        line = f"{'G3' if ccw else 'G2'} X{fmt(end[0])} Y{fmt(end[1])} I{fmt(offset[0])} J{fmt(offset[1])}{modal}\n"
+                    if reduction is not None:
+                        reduction.moves += 1
+                        reduction.size += len(line)
+                    yield line
+                    modal = ""
+                    start = end
+                if reduction is not None:
+                    reduction.vertices += len(path) - 1
+                    reduction.flat_size += len(f" F{speed} S{power}") + sum(
+                        len(f"G1 X{fmt(x)} Y{fmt(y)}\n") for x, y in path[1:].tolist())
+    yield "M5\n"
+    yield "G0 X0 Y0\n"
+
+def hpgl_lines(layers, height):
+    """
+    HPGL for a job, instruction by instruction.
+
+    Each layer gets its own pen, in order, with its speed as the pen velocity. Power is left to the
+    pen settings of the machine driver, HPGL has no standard way to set it.
+    """
+    yield "IN;\n"
+    for pen, (name, profile, paths) in enumerate(layers, start=1):
+        yield f"SP{pen};\n"
+        # VS is in cm/s
+        yield f"VS{format_number(profile.speed / 600, 2)};\n"
+        for path in paths:
+            path = np.rint(_machine_coords(path, height) * HPGL_UNITS).astype(int)
+            # Vertices closer than a plotter unit collapse into one
+            path = path[np.concatenate([[True], (path[1:] != path[:-1]).any(axis=1)])]
+            for _ in range(profile.passes):
+                yield f"PU{path[0, 0]},{path[0, 1]};\n"
+                yield "PD" + ",".join(f"{x},{y}" for x, y in path[1:].tolist()) + ";\n"
+    yield "PU;\n"
+    yield "SP0;\n"
+
+def write_job(filename, lines, buffering=1 << 16):
+    """ Writes the lines of a job as they are generated """
+    with open(filename, "w", buffering=buffering) as f:
+        f.writelines(lines)
@@ -1,16 +1,29 @@
+import collections
+import itertools
 import math
 import functools
 import logging
+import time
+import numpy as np
+import shapely
 
-from collections import defaultdict
-from shapely import affinity
 from shapely.geometry import *
-from shapely.geometry.polygon import orient
 
-from . import hersheydata
+from . import hershey
+from .trace import traced
 
 DEFAULT_TOLERANCE=.1
 
+# Shapely geometry type ids
+POINT, LINESTRING, LINEARRING, POLYGON = 0, 1, 2, 3
+MULTI_TYPES = 4
+
+MULTI_CONSTRUCTORS = {
+    POINT: shapely.multipoints,
+    LINESTRING: shapely.multilinestrings,
+    POLYGON: shapely.multipolygons,
+}
+
 @functools.lru_cache(maxsize = None)
 def binom_coefs(n):
     """ Binomial coefs needed by bezier """
@@ -23,30 +36,190 @@ def binom_coefs(n):
         for a, b in zip(base + [0], [0] + base)
     ]
 
-def bezier(*points, tolerance=DEFAULT_TOLERANCE):
-    size = math.sqrt(sum([
-      (max([p[dimension] for p in points]) - min([p[dimension] for p in points]))**2
-      for dimension in range(2)
-    ]))
-    npoints = max(8, int(math.ceil(size / tolerance)))
-    if len(points) <= 2:
-        npoints = len(points)
+@functools.lru_cache(maxsize = None)
+def bernstein_basis(degree, npoints):
+    """ Bernstein basis matrix, with shape (npoints+1, degree+1), sampled uniformly in t """
+    t = (np.arange(npoints + 1) / npoints)[:, None]
+    exps = np.arange(degree + 1)
+    basis = np.array(binom_coefs(degree + 1), dtype=float) * (1 - t)**(degree - exps) * t**exps
+    basis.flags.writeable = False
+    return basis
+
+# Curves are never split more times than this, even if a span still isn't flat (e.g. a degenerate curve)
+MAX_SUBDIVISIONS = 16
 
-    bezier_coefs = binom_coefs(len(points))
-    bezier_exps = [ (len(points) - j - 1, j) for j in range(len(points)) ]
+# Points where the distance of a span to its chord is sampled, see `bezier_flatness`
+FLATNESS_SAMPLES = 16
 
-    ret = []
-    for i in range(npoints+1):
-        t = i / npoints
-        ret.append(tuple(
-            sum([
-                coef * ((1 - t)**exps[0]) * ((t)**exps[1]) * point[dimension]
-                for coef, exps, point in zip(bezier_coefs, bezier_exps, points)
-            ])
-            for dimension in range(2)
-        ))
-    return LineString(ret).simplify(tolerance=tolerance)
+@functools.lru_cache(maxsize = None)
+def bernstein_peaks(degree):
+    """ Largest value of each inner Bernstein polynomial of `degree`, reached at t = i / degree """
+    i = np.arange(1, degree)
+    peaks = np.array(binom_coefs(degree + 1)[1:-1], dtype=float) * (i / degree)**i * (1 - i / degree)**(degree - i)
+    peaks.flags.writeable = False
+    return peaks
+
+def bezier_flatness(controls):
+    """
+    Upper bound on how far each curve strays from the chord between its ends.
+
+    The signed distance of a curve to the chord's line, and its position along the chord, are
+    themselves Bézier polynomials, with the control points' distances and positions as coefficients.
+    They are sampled at `FLATNESS_SAMPLES` points, and between samples they can't stray further than
+    their second derivatives allow. A curve is then no further from the chord than the hypotenuse of
+    its largest distance to the chord's line and its largest overshoot past either end.
+
+    If a curve ends where it starts, its inner control points' distances from that point,
+    weighted by the peaks of their Bernstein polynomials, bound it instead.
+    """
+    degree = controls.shape[1] - 1
+    basis = bernstein_basis(degree, FLATNESS_SAMPLES)
+    a = controls[:, :1]
+    chord = controls[:, -1:] - a
+    relative = controls - a
+    length = np.sqrt((chord**2).sum(axis=2))
+
+    def sampled(coefs):
+        """ Samples of the polynomials with `coefs`, and how far they may stray between them """
+        slack = degree * (degree - 1) / 8 / FLATNESS_SAMPLES**2 * np.abs(np.diff(coefs, 2, axis=1)).max(axis=1, initial=0)
+        return coefs @ basis.T, slack
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distances, distances_slack = sampled((chord[..., 0] * relative[..., 1] - chord[..., 1] * relative[..., 0]) / length)
+        positions, positions_slack = sampled((chord * relative).sum(axis=2) / length)
+        overshoot = np.maximum(0, np.maximum(-positions, positions - length).max(axis=1)) + positions_slack
+        flatness = np.hypot(np.abs(distances).max(axis=1) + distances_slack, overshoot)
+
+    loops = length[:, 0] == 0
+    flatness[loops] = np.hypot(relative[loops, 1:-1, 0], relative[loops, 1:-1, 1]) @ bernstein_peaks(degree)
+    return flatness
+
+def bezier_split(controls, t):
+    """ Control polygons of the two parts of each curve, split at its own `t` with de Casteljau's algorithm """
+    t = np.asarray(t, dtype=float)[:, None, None]
+    left, right = [controls[:, 0]], [controls[:, -1]]
+    points = controls
+    while points.shape[1] > 1:
+        points = (1 - t) * points[:, :-1] + t * points[:, 1:]
+        left.append(points[:, 0])
+        right.append(points[:, -1])
+    return np.stack(left, axis=1), np.stack(right[::-1], axis=1)
+
+def bezier_subdivide(controls, tolerance=DEFAULT_TOLERANCE):
+    """
+    Flattens curves by recursive subdivision: spans that are within `tolerance` of their chord
+    become a single segment, the others are split and tested again.
+
+    A span `n` times further from its chord than allowed should take about `sqrt(n)` segments (the
+    distance shrinks with the square of the span), so it is split where half of them would end on
+    either side, rather than always in the middle: in half for an even count, and around a middle
+    segment for an odd one. Splits are symmetric in `t`, so a curve and its reverse (e.g. a link of
+    a reflected tile) are flattened alike.
+
+    Returns the vertices of all curves, one after the other, and the curve each one belongs to.
+    """
+    ncurves = len(controls)
+    # The start of each span is a vertex, plus the end of each curve
+    curves = [np.arange(ncurves)]
+    ts = [np.ones(ncurves)]
+    vertices = [controls[:, -1]]
+
+    spans, span_curves, span_ts, span_ends = controls, np.arange(ncurves), np.zeros(ncurves), np.ones(ncurves)
+    for depth in range(MAX_SUBDIVISIONS + 1):
+        flatness = bezier_flatness(spans)
+        flat = flatness <= tolerance if depth < MAX_SUBDIVISIONS else np.ones(len(spans), dtype=bool)
+        curves.append(span_curves[flat])
+        ts.append(span_ts[flat])
+        vertices.append(spans[flat, 0])
+
+        split = ~flat
+        if not split.any():
+            break
+        segments = np.maximum(2, np.ceil(np.sqrt(flatness[split] / tolerance)))
+        middle = np.floor(segments / 2) / segments
+        bounds = np.stack([np.zeros_like(middle), middle, 1 - middle, np.ones_like(middle)], axis=1)
+        # Parts [0, middle], [middle, 1 - middle] (for odd counts only) and [1 - middle, 1]
+        parts = np.ones((len(segments), 3), dtype=bool)
+        parts[:, 1] = segments % 2 == 1
+        parents = np.repeat(np.flatnonzero(split), parts.sum(axis=1))
+        start, end = bounds[:, :-1][parts], bounds[:, 1:][parts]
+
+        # Part [start, end] is the end of the curve's part [0, end]
+        heads, _ = bezier_split(spans[parents], end)
+        _, spans = bezier_split(heads, start / end)
+        span_curves = span_curves[parents]
+        span_ts, span_ends = (
+            span_ts[parents] + start * (span_ends[parents] - span_ts[parents]),
+            span_ts[parents] + end * (span_ends[parents] - span_ts[parents]))
+
+    curves, ts, vertices = np.concatenate(curves), np.concatenate(ts), np.concatenate(vertices)
+    order = np.lexsort((ts, curves))
+    return vertices[order], curves[order]
+
+@traced(vertices=True)
+def bezier_batch(controls, tolerance=DEFAULT_TOLERANCE, adaptive=False):
+    """
+    Flattens many Bézier curves of the same degree at once.
+
+    `controls` is an (N, k, 2) array of control polygons, and an array of N LineStrings is returned.
+
+    By default curves are densely sampled and then simplified. With `adaptive`, they are subdivided
+    only where they bend (see `bezier_subdivide`), and the simplify pass is skipped.
+    """
+    controls = np.asarray(controls, dtype=float)
+    ncurves, k, _ = controls.shape
 
+    if adaptive:
+        vertices, curves = bezier_subdivide(controls, tolerance)
+        return shapely.linestrings(vertices, indices=curves)
+    if k <= 2:
+        npoints = np.full(ncurves, k)
+    else:
+        size = np.hypot(*(controls.max(axis=1) - controls.min(axis=1)).T)
+        npoints = np.maximum(8, np.ceil(size / tolerance).astype(int))
+
+    # Curves with the same number of samples share the same basis matrix
+    starts = np.concatenate([[0], np.cumsum(npoints + 1)])
+    coords = np.empty((starts[-1], 2))
+    for n in np.unique(npoints):
+        selected = np.flatnonzero(npoints == n)
+        samples = np.einsum("ij,cjd->cid", bernstein_basis(k - 1, n), controls[selected])
+        coords[(starts[selected][:, None] + np.arange(n + 1)).ravel()] = samples.reshape(-1, 2)
+
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(ncurves), npoints + 1))
+    return shapely.simplify(lines, tolerance=tolerance)
+
+def flattening_report(controls, tolerance=DEFAULT_TOLERANCE):
+    """ Compares uniform and adaptive flattening of the same curves, in vertex counts and seconds """
+    report = {}
+    for mode, adaptive in [("uniform", False), ("adaptive", True)]:
+        start = time.perf_counter()
+        lines = bezier_batch(controls, tolerance=tolerance, adaptive=adaptive)
+        report[f"{mode}_seconds"] = time.perf_counter() - start
+        report[f"{mode}_vertices"] = int(shapely.get_num_coordinates(lines).sum())
+    report["saved_vertices"] = report["uniform_vertices"] - report["adaptive_vertices"]
+
+    logging.getLogger('bezier').info(
+        f"Adaptive flattening saved {report['saved_vertices']} of {report['uniform_vertices']} vertices, "
+        f"{report['uniform_seconds'] * 1000:.2f}ms -> {report['adaptive_seconds'] * 1000:.2f}ms")
+    return report
+
+def bezier(*points, tolerance=DEFAULT_TOLERANCE, adaptive=False):
+    return bezier_batch([points], tolerance=tolerance, adaptive=adaptive)[0]
+
+def place(geoms, matrices, offsets):
+    """ Applies its own linear transform and then translation to each geometry, in a single pass """
+    geoms = np.asarray(geoms, dtype=object)
+    counts = shapely.get_num_coordinates(geoms)
+    matrices = np.repeat(np.asarray(matrices, dtype=float).reshape(-1, 2, 2), counts, axis=0)
+    offsets = np.repeat(np.asarray(offsets, dtype=float).reshape(-1, 2), counts, axis=0)
+    return shapely.transform(geoms, lambda coords: np.einsum("nij,nj->ni", matrices, coords) + offsets)
+
+def snap(geoms, decimals=9):
+    """ Rounds off the float noise of `geoms`, so that points computed in different ways meet exactly """
+    return shapely.transform(geoms, lambda coords: coords.round(decimals))
+
+@traced(vertices=True)
 def rounded(geom, radius, tolerance=DEFAULT_TOLERANCE):
     resolution = max(16, int(2 * math.pi * radius / tolerance / 4))
     return geom.buffer(-radius, resolution=resolution).buffer(+radius, resolution=resolution)
@@ -59,119 +232,152 @@ def rect(x, y):
         (x[0], y[1]),
     ])
 
+@traced(vertices=True)
 def text(text, font="futural", scale=1, translate=(0,0), align=0, valign=0):
-    font = getattr(hersheydata, font)
     spacing = 3  # spacing between letters
 
     # Look into zero to get vertical metrics
-    vref_glyph = font[ord("0") - 32]
-    vref_glyph_y = [float(y) for y in vref_glyph.split(" ")[4::3]]
-    vref_min = min(vref_glyph_y)
-    vref_max = max(vref_glyph_y)
-    vref_mean = (vref_max + vref_min) / 2
+    vref_glyph_y = hershey.glyph(font, ord("0") - 32)[0][:, 1]
+    vref_min = vref_glyph_y.min()
+    vref_max = vref_glyph_y.max()
     vref_range = (vref_max - vref_min)
 
     x_offset = 0.
-    all_outlines = []
-    current_outline = None
+    all_coords = []
+    all_stroke_ids = []
+    nstrokes = 0
 
-    letter_vals = (ord(q) - 32 for q in text)
     for glyph in text:
         glyph_val = ord(glyph) - 32
         if glyph_val < 0 or glyph_val > 95:
             logging.getLogger('hershey_text').warning(f"Skipping unsupported glyph '{glyph}'")
             x_offset += 2 * spacing
         else:
-            glyph_path = font[glyph_val].split(" ")
-            offset1, offset2 = float(glyph_path[0]), float(glyph_path[1])
+            coords, stroke_ids, offset1, offset2 = hershey.glyph(font, glyph_val)
 
             x_offset -= offset1
-            for cmd, x, y in zip(*((iter(glyph_path[2:]),)*3)):
-                if cmd == 'M':
-                    if current_outline:
-                        all_outlines.append(current_outline)
-                    current_outline = []
-                current_outline.append((x_offset+float(x), float(y)))
-            if current_outline:
-                all_outlines.append(current_outline)
+            all_coords.append(coords + (x_offset, 0))
+            all_stroke_ids.append(stroke_ids + nstrokes)
+            if len(stroke_ids):
+                nstrokes = all_stroke_ids[-1][-1] + 1
             x_offset += offset2
 
-    ret = MultiLineString(all_outlines)
-    ret = affinity.translate(
-            ret,
-            xoff=x_offset * .5 * (align - 1),
-            yoff=-vref_min + vref_range * .5 * (valign - 1) )
-    ret = affinity.scale(ret, xfact=scale, yfact=scale, origin=(0,0))
-    ret = affinity.translate(ret, xoff=translate[0], yoff=translate[1])
-    return ret
+    if not nstrokes:
+        return MultiLineString()
+
+    # Alignment, scale and translation, all in a single transform
+    coords = np.concatenate(all_coords)
+    coords += (x_offset * .5 * (align - 1), -vref_min + vref_range * .5 * (valign - 1))
+    coords *= scale
+    coords += translate
+    return shapely.multilinestrings(shapely.linestrings(coords, indices=np.concatenate(all_stroke_ids)))
+
+def signed_areas(coords, index, count):
+    """ Signed area of each of `count` closed paths, given as `shapely.get_coordinates(..., return_index=True)` """
+    x, y = coords[:, 0], coords[:, 1]
+    cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+    # Segments joining the end of a path to the start of the next don't count
+    same = index[:-1] == index[1:]
+    return np.bincount(index[:-1][same], weights=cross[same], minlength=count) / 2
 
+@traced(vertices=True)
 def draw_shape(cairo_context, shape):
-    def draw_coords(coords, close, ccw=True):
-
-        # Force proper orientation of lines
-        if close:
-            coords = orient(Polygon(coords), sign=1 if ccw else -1).exterior.coords
-
-        for i, p in enumerate(coords):
-            if i == 0:
-                cairo_context.move_to(*p)
-            else:
-                cairo_context.line_to(*p)
-        if close:
-            cairo_context.close_path()
+    """
+    Adds the paths of `shape` to the cairo context, with rings closed.
+
+    Polygon exteriors and standalone rings run counterclockwise, and holes clockwise, so they fill
+    with any fill rule. Coordinates are fed to cairo by `itertools.starmap`, without an interpreter
+    call for each vertex.
+    """
+    paths, closed, exterior = _line_parts([shape])
+    if not len(paths):
+        return
+
+    coords, index = shapely.get_coordinates(paths, return_index=True)
+    areas = signed_areas(coords, index, len(paths))
+    # Force proper orientation of rings
+    reverse = closed & (np.where(exterior, areas, -areas) < 0)
 
-    def draw_internal(shape):
-        if isinstance(shape, (MultiPoint, MultiLineString, MultiPolygon, GeometryCollection)):
-            for x in shape.geoms:
-                draw_internal(x)
-        elif isinstance(shape, Point):
-            pass # Not supported
-        elif isinstance(shape, LineString):
-            draw_coords(shape.coords, close=False)
-        elif isinstance(shape, LinearRing):
-            draw_coords(shape.coords, close=True)
-        elif isinstance(shape, Polygon):
-            draw_coords(shape.exterior.coords, close=True)
-            for interior in shape.interiors:
-                draw_coords(interior.coords, close=True, ccw=False)
-
-    draw_internal(shape)
+    starts = np.searchsorted(index, np.arange(len(paths) + 1))
+    line_to = cairo_context.line_to
+    for path, (start, end) in enumerate(zip(starts[:-1].tolist(), starts[1:].tolist())):
+        path_coords = coords[start:end]
+        if reverse[path]:
+            path_coords = path_coords[::-1]
+        path_coords = path_coords.tolist()
+        cairo_context.move_to(*path_coords[0])
+        collections.deque(itertools.starmap(line_to, path_coords[1:]), maxlen=0)
+        if closed[path]:
+            cairo_context.close_path()
 
 def all_geoms(*geoms):
+    """
+    Every single-part geometry in `geoms`, as a flat object array.
+
+    `geoms` can be geometries, arrays of geometries or iterables of them, nested in any way. Only
+    the iterables are walked in Python, collections are split by shapely.
+    """
+    items = []
     def visit(geom):
-        if isinstance(geom, (Point, LineString, Polygon, LinearRing)):
-            yield geom
-        elif isinstance(geom, (MultiPoint, MultiLineString, MultiPolygon, GeometryCollection)):
-            for x in geom.geoms:
-                yield from visit(x)
+        if isinstance(geom, shapely.Geometry):
+            items.append(geom)
+        elif isinstance(geom, np.ndarray):
+            items.extend(geom.ravel())
         else:
             # Assume it is an iterator-of-geometries
             for x in geom:
-                yield from visit(x)
+                visit(x)
 
     for geom in geoms:
-        yield from visit(geom)
+        visit(geom)
 
-def compose(*geoms):
-    geom_by_type = defaultdict(list)
+    ret = np.empty(len(items), dtype=object)
+    ret[:] = items
+    # Collections may hold other collections
+    while len(ret) and (shapely.get_type_id(ret) >= MULTI_TYPES).any():
+        ret = shapely.get_parts(ret)
+    return ret
+
+def _line_parts(geoms):
+    """ `line_parts`, with whether each one is closed, and whether it's not a hole """
+    parts = all_geoms(*geoms)
+    types = shapely.get_type_id(parts)
+    polygons = np.flatnonzero(types == POLYGON)
+    lines = np.flatnonzero(((types == LINESTRING) | (types == LINEARRING)) & ~shapely.is_empty(parts))
+    rings, ring_index = shapely.get_rings(parts[polygons], return_index=True)
+    exteriors = np.ones(len(rings), dtype=bool)
+    exteriors[1:] = ring_index[1:] != ring_index[:-1]
+
+    # Rings take the place of their polygon
+    order = np.argsort(np.concatenate([polygons[ring_index], lines]), kind="stable")
+    return (
+        np.concatenate([rings, parts[lines]])[order],
+        np.concatenate([np.ones(len(rings), dtype=bool), types[lines] == LINEARRING])[order],
+        np.concatenate([exteriors, np.ones(len(lines), dtype=bool)])[order],
+    )
 
-    for geom in all_geoms(*geoms):
-        geom_by_type[type(geom)].append(geom)
+def line_parts(*geoms):
+    """ Every non-empty LineString and LinearRing in `geoms`, with polygons split into their rings, in order """
+    return _line_parts(geoms)[0]
+
+@traced(vertices=True)
+def compose(*geoms):
+    """ Every geometry in `geoms`, with those of the same type merged into a single multi-part geometry """
+    parts = all_geoms(*geoms)
+    types = shapely.get_type_id(parts)
+    _, first = np.unique(types, return_index=True)
 
     ret = []
-    for geom_type, geoms in geom_by_type.items():
-        if len(geoms) == 1:
-            ret += geoms
-        if geom_type == Point:
-            ret.append(MultiPoint(geoms))
-        elif geom_type == LineString:
-            ret.append(MultiLineString(geoms))
-        elif geom_type == Polygon:
-            ret.append(MultiPolygon(geoms))
+    for geom_type in types[np.sort(first)]:
+        group = parts[types == geom_type]
+        if len(group) == 1:
+            ret.append(group[0])
+        elif geom_type in MULTI_CONSTRUCTORS:
+            ret.append(MULTI_CONSTRUCTORS[geom_type](group))
         else:
-            ret += geoms
+            ret += list(group)
 
     if len(ret) == 1:
         return ret[0]
     else:
-        return GeometryCollection(ret)
+        return shapely.geometrycollections(ret)
@@ -0,0 +1,105 @@
+"""
+Compiled store for the Hershey fonts in `hersheydata`.
+
+Glyph strings are parsed once into float32 arrays and saved to `hersheydata.npz`, with one set of
+arrays per font. Fonts are loaded from the store lazily, one at a time, so `hersheydata` itself is
+only imported to regenerate the store:
+
+    python -m utils.hershey
+"""
+
+import functools
+import pathlib
+import numpy as np
+
+STORE_PATH = pathlib.Path(__file__).with_name("hersheydata.npz")
+
+class Font:
+    """
+    A parsed Hershey font.
+
+    - `coords`: (P, 2) float32 array with the vertices of every stroke
+    - `strokes`: (S+1,) int32 array with the offset of each stroke in `coords`
+    - `glyphs`: (G+1,) int32 array with the offset of each glyph in `strokes`
+    - `advances`: (G, 2) float32 array with the left and right offsets of each glyph
+    """
+
+    FIELDS = ("coords", "strokes", "glyphs", "advances")
+
+    def __init__(self, coords, strokes, glyphs, advances):
+        self.coords = coords
+        self.strokes = strokes
+        self.glyphs = glyphs
+        self.advances = advances
+
+    def __len__(self):
+        return len(self.advances)
+
+    @staticmethod
+    def parse(glyph_strings):
+        coords = []
+        strokes = [0]
+        glyphs = [0]
+        advances = []
+
+        for glyph in glyph_strings:
+            glyph_path = glyph.split(" ")
+            advances.append((float(glyph_path[0]), float(glyph_path[1])))
+
+            for cmd, x, y in zip(*((iter(glyph_path[2:]),)*3)):
+                if cmd == 'M' and len(coords) > strokes[-1]:
+                    strokes.append(len(coords))
+                coords.append((float(x), float(y)))
+            if len(coords) > strokes[-1]:
+                strokes.append(len(coords))
+            glyphs.append(len(strokes) - 1)
+
+        return Font(
+            coords=np.array(coords, dtype=np.float32).reshape(-1, 2),
+            strokes=np.array(strokes, dtype=np.int32),
+            glyphs=np.array(glyphs, dtype=np.int32),
+            advances=np.array(advances, dtype=np.float32))
+
+def compile_store(path=STORE_PATH):
+    """ Parses every font in `hersheydata` and writes them to the compiled store """
+    from . import hersheydata
+
+    arrays = {}
+    for name, _ in hersheydata.group_allfonts:
+        font = Font.parse(getattr(hersheydata, name))
+        for field in Font.FIELDS:
+            arrays[f"{name}.{field}"] = getattr(font, field)
+    np.savez_compressed(path, **arrays)
+
+@functools.lru_cache(maxsize = None)
+def load_font(name):
+    if STORE_PATH.exists():
+        with np.load(STORE_PATH) as store:
+            if f"{name}.coords" in store:
+                return Font(*(store[f"{name}.{field}"] for field in Font.FIELDS))
+
+    # Store is missing or outdated, parse the font directly
+    from . import hersheydata
+    return Font.parse(getattr(hersheydata, name))
+
+@functools.lru_cache(maxsize = None)
+def glyph(font, index):
+    """
+    Returns the strokes of a glyph, as `(coords, stroke_ids, left, right)`.
+
+    `coords` is an (n, 2) array, and `stroke_ids` gives the index of the stroke each vertex belongs to.
+    """
+    font = load_font(font)
+    first_stroke, last_stroke = font.glyphs[index], font.glyphs[index+1]
+    strokes = font.strokes[first_stroke:last_stroke+1]
+
+    coords = font.coords[strokes[0]:strokes[-1]].astype(float)
+    stroke_ids = np.repeat(np.arange(len(strokes) - 1), np.diff(strokes))
+    for array in coords, stroke_ids:
+        array.flags.writeable = False
+
+    left, right = font.advances[index]
+    return coords, stroke_ids, float(left), float(right)
+
+if __name__ == "__main__":
+    compile_store()
@@ -0,0 +1,196 @@
+"""
+Nesting of parts onto sheets of stock material.
+
+Parts are first packed by their bounding boxes, with a skyline bottom-left heuristic, optionally
+rotated by 90°, onto as many sheets as needed. Optionally, each part is then slid towards the origin as
+far as its actual outline allows, closing the gaps the bounding boxes leave around rounded corners
+and irregular outlines.
+"""
+
+import collections
+import numpy as np
+import shapely
+
+from .geom import place
+
+# Position of a part: the part's bounding box, rotated 90° counterclockwise if `rotated`, has its
+# corner at (x, y) of `sheet`
+Placement = collections.namedtuple("Placement", ["sheet", "x", "y", "rotated"])
+
+ROTATION = np.array([[0, -1], [1, 0]])
+
+def footprint(cuts):
+    """ Region taken by a part on the sheet, the cut polygons with their holes filled """
+    polygons = shapely.get_parts(shapely.union_all(cuts))
+    return shapely.union_all(shapely.polygons(shapely.get_exterior_ring(polygons[shapely.get_type_id(polygons) == 3])))
+
+def transform(geom, bounds, placement):
+    """ Moves `geom`, from a part with the given bounds, to its placement """
+    min_x, min_y, max_x, max_y = bounds
+    if placement.rotated:
+        matrix = ROTATION
+        offset = (placement.x + max_y, placement.y - min_x)
+    else:
+        matrix = np.identity(2)
+        offset = (placement.x - min_x, placement.y - min_y)
+    return place([geom], [matrix], [offset])[0]
+
+class Skyline:
+    """ Bottom-left skyline packing of rectangles into one sheet """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # Segments of the skyline, as [x, y, width], left to right
+        self.segments = [[0., 0., width]]
+
+    def find(self, width, height):
+        """ Lowest (then leftmost) position for a rectangle, as `(top, x, y, index)`, or None """
+        best = None
+        for i, (x, _, _) in enumerate(self.segments):
+            if x + width > self.width + 1e-9:
+                break
+            # Height of the skyline under the rectangle
+            y = 0.
+            remaining = width
+            for _, segment_y, segment_width in self.segments[i:]:
+                y = max(y, segment_y)
+                remaining -= segment_width
+                if remaining <= 1e-9:
+                    break
+            if y + height > self.height + 1e-9:
+                continue
+            if best is None or (y + height, x) < best[:2]:
+                best = (y + height, x, y, i)
+        return best
+
+    def insert(self, index, x, y, width, height):
+        top = y + height
+        end = x + width
+
+        # Segments under the new one are cut off, the last one may stick out to its right
+        j = index
+        while j < len(self.segments) and self.segments[j][0] + self.segments[j][2] <= end + 1e-9:
+            j += 1
+        tail = []
+        if j < len(self.segments) and self.segments[j][0] < end:
+            segment_x, segment_y, segment_width = self.segments[j]
+            tail = [[end, segment_y, segment_x + segment_width - end]]
+            j += 1
+        self.segments[index:j] = [[x, top, width]] + tail
+
+        # Merge neighbours at the same height
+        merged = []
+        for segment in self.segments:
+            if merged and abs(merged[-1][1] - segment[1]) < 1e-9:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        self.segments = merged
+
+def pack(sizes, sheet_width, sheet_height, spacing=0., rotate=True):
+    """
+    Packs rectangles of the given `(width, height)` onto sheets, returning a `Placement` for each.
+
+    Rectangles are kept `spacing` apart from each other and from the sheet edges. Larger rectangles
+    are placed first, each onto the first sheet it fits in.
+    """
+    inner_width = sheet_width - spacing
+    inner_height = sheet_height - spacing
+    sheets = []
+    placements = [None] * len(sizes)
+
+    for i in sorted(range(len(sizes)), key=lambda i: (-max(sizes[i]), -min(sizes[i]))):
+        width, height = sizes[i]
+        orientations = [(width + spacing, height + spacing, False)]
+        if rotate and width != height:
+            orientations.append((height + spacing, width + spacing, True))
+        if all(w > inner_width + 1e-9 or h > inner_height + 1e-9 for w, h, _ in orientations):
+            raise ValueError(f"Part of {width:g}x{height:g}mm doesn't fit on a {sheet_width:g}x{sheet_height:g}mm sheet")
+
+        for sheet_index in range(len(sheets) + 1):
+            if sheet_index == len(sheets):
+                sheets.append(Skyline(inner_width, inner_height))
+            sheet = sheets[sheet_index]
+            candidates = [
+                (fit, w, h, rotated)
+                for w, h, rotated in orientations
+                if (fit := sheet.find(w, h)) is not None
+            ]
+            if candidates:
+                (_, x, y, index), w, h, rotated = min(candidates, key=lambda candidate: candidate[0][:2])
+                sheet.insert(index, x, y, w, h)
+                placements[i] = Placement(sheet_index, x + spacing, y + spacing, rotated)
+                break
+
+    return placements
+
+def _slide(shape, obstacles, axis, limit, spacing, steps=12):
+    """ How far `shape` can move towards the origin along `axis`, up to `limit`, without getting within `spacing` of `obstacles` """
+    def fits(distance):
+        moved = shapely.transform(shape, lambda coords: coords - distance * np.eye(2)[axis])
+        return not any(shapely.dwithin(obstacles, moved, spacing)) if len(obstacles) else True
+
+    if limit <= 0 or fits(limit):
+        return max(limit, 0)
+    lo, hi = 0., limit
+    for _ in range(steps):
+        mid = (lo + hi) / 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+def _overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def refine(footprints, placements, spacing=0., passes=2):
+    """
+    Slides every placed part towards the origin of its sheet, as far as its footprint allows.
+
+    `footprints` are the parts' regions, already moved to their placements. Returns the new
+    placements.
+    """
+    placements = list(placements)
+    # Outlines are simplified to speed up the distance checks, which then keep extra room for the error
+    tolerance = max(spacing, 1) / 8
+    footprints = list(shapely.simplify(footprints, tolerance))
+    all_bounds = shapely.bounds(footprints)
+    for _ in range(passes):
+        moved = False
+        for i in sorted(range(len(placements)), key=lambda i: (placements[i].sheet, placements[i].y, placements[i].x)):
+            for axis in (1, 0):
+                bounds = np.array(footprints[i].bounds)
+                limit = bounds[axis] - spacing - tolerance
+                # Only parts in the way of the slide can stop it
+                swept = bounds + np.array([-1, -1, 1, 1]) * (spacing + 2 * tolerance)
+                swept[axis] -= limit
+                others = np.array([
+                    footprints[j] for j in range(len(placements))
+                    if j != i and placements[j].sheet == placements[i].sheet and _overlap(swept, all_bounds[j])
+                ], dtype=object)
+                distance = _slide(footprints[i], others, axis, limit, spacing + 2 * tolerance)
+                if distance > 1e-3:
+                    footprints[i] = shapely.transform(footprints[i], lambda coords: coords - distance * np.eye(2)[axis])
+                    all_bounds[i] = footprints[i].bounds
+                    x, y = placements[i].x, placements[i].y
+                    placements[i] = placements[i]._replace(**{"xy"[axis]: (x, y)[axis] - distance})
+                    moved = True
+        if not moved:
+            break
+    return placements
+
+def nest(footprints, sheet_width, sheet_height, spacing=0., rotate=True, polygon_refinement=False):
+    """
+    Nests parts, given by their footprints, onto sheets.
+
+    Returns a `Placement` for each part, and the number of sheets used.
+    """
+    bounds = [shapely.bounds(footprint) for footprint in footprints]
+    sizes = [(max_x - min_x, max_y - min_y) for min_x, min_y, max_x, max_y in bounds]
+    placements = pack(sizes, sheet_width, sheet_height, spacing, rotate)
+    if polygon_refinement:
+        placed = [transform(footprint, b, p) for footprint, b, p in zip(footprints, bounds, placements)]
+        placements = refine(placed, placements, spacing)
+    return placements, max(p.sheet for p in placements) + 1 if placements else 0
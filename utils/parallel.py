@@ -0,0 +1,24 @@
+import concurrent.futures
+
+class SerialExecutor(concurrent.futures.Executor):
+    """ Executor that runs everything in the calling thread, as soon as it is submitted """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+def process_executor(jobs):
+    """ A process pool with `jobs` workers, or a serial executor if no parallelism was requested """
+    if jobs is not None and jobs <= 1:
+        return SerialExecutor()
+    return concurrent.futures.ProcessPoolExecutor(jobs)
+
+def thread_executor(threads):
+    """ A thread pool with `threads` workers, or a serial executor if no parallelism was requested """
+    if threads is not None and threads <= 1:
+        return SerialExecutor()
+    return concurrent.futures.ThreadPoolExecutor(threads)
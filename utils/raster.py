@@ -0,0 +1,147 @@
+"""
+Raster (PNG) previews of parts, rendered with cairo.
+
+Parts are split into tiles, rendered independently on an executor (the geometry travels as WKB, so a
+process pool works) and stitched back together, so large parts neither take one core for long nor
+need a single huge surface per worker. Tiles are drawn from geometry clipped a little beyond their
+edges, which keeps them seamless.
+
+Smaller sizes are scaled down from a larger render, by halving it as far as possible (the levels of
+its mipmap pyramid) and then smoothly scaling the rest of the way, instead of drawing the geometry
+again.
+
+Pixels are kept as `(height, width, 4)` arrays of cairo's ARGB32 (premultiplied alpha) format.
+Only the functions that need cairo import it.
+"""
+
+import collections
+import io
+import math
+import numpy as np
+import shapely
+from shapely.ops import unary_union
+
+from .geom import all_geoms, draw_shape
+from . import trace
+
+MM_PER_INCH = 25.4
+
+FILL_COLOR = (.82, .71, .55)
+OUTLINE_COLOR = (0, 0, 0)
+ENGRAVING_COLOR = (0.23, 0.13, 0.06)
+LINE_WIDTH = .2
+
+# `dpis` are the resolutions to write each part at, and mipmaps are made from the largest one
+RasterSettings = collections.namedtuple("RasterSettings", ["dpis", "mipmaps", "tile_size"], defaults=[(96,), False, 512])
+
+def draw_preview(context, cuts, outlines, engravings):
+    """ Draws a part as it looks once cut: filled cuts, with the outlines and engravings stroked over them """
+    draw_shape(context, cuts)
+    context.set_source_rgb(*FILL_COLOR)
+    context.fill()
+
+    draw_shape(context, outlines)
+    context.set_source_rgb(*OUTLINE_COLOR)
+    context.set_line_width(LINE_WIDTH)
+    context.stroke()
+
+    draw_shape(context, engravings)
+    context.set_source_rgb(*ENGRAVING_COLOR)
+    context.set_line_width(LINE_WIDTH)
+    context.stroke()
+
+def pixel_size(width, height, dpi):
+    """ Size in pixels of a `width` x `height` mm part at `dpi` """
+    return max(1, round(width * dpi / MM_PER_INCH)), max(1, round(height * dpi / MM_PER_INCH))
+
+def mipmap_levels(width, height):
+    """ Number of images in the mipmap pyramid of a `width` x `height` image, down to 1x1 """
+    return 1 + math.ceil(math.log2(max(width, height)))
+
+def _surface(pixels):
+    import cairo
+    height, width, _ = pixels.shape
+    return cairo.ImageSurface.create_for_data(np.ascontiguousarray(pixels), cairo.FORMAT_ARGB32, width, height)
+
+def _pixels(surface):
+    surface.flush()
+    width, height, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+    return np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(height, stride)[:, :4 * width].reshape(height, width, 4).copy()
+
+@trace.traced()
+def render_tile(cuts, outlines, engravings, scale, x, y, width, height):
+    """ Pixels of the `width` x `height` tile at `(x, y)` of a part (given as WKB), drawn at `scale` pixels per mm """
+    import cairo
+
+    # Strokes reaching into the tile from outside must still be drawn
+    margin = LINE_WIDTH
+    box = (x / scale - margin, y / scale - margin, (x + width) / scale + margin, (y + height) / scale + margin)
+    cuts, outlines, engravings = (
+        shapely.clip_by_rect(all_geoms(shapely.from_wkb(geom)), *box)
+        for geom in (cuts, outlines, engravings)
+    )
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    context = cairo.Context(surface)
+    # Tiles are offset by whole pixels, so they line up exactly
+    context.translate(-x, -y)
+    context.scale(scale, scale)
+    draw_preview(context, cuts, outlines, engravings)
+    return _pixels(surface)
+
+def render(executor, cuts, engravings, width, height, dpi, tile_size=512):
+    """ Pixels of a `width` x `height` mm part (given as WKB) at `dpi`, rendered by tiles on `executor` """
+    pixel_width, pixel_height = pixel_size(width, height, dpi)
+    with trace.span("outline_union"):
+        outlines = shapely.to_wkb(unary_union(shapely.from_wkb(cuts).boundary))
+
+    tiles = [
+        (x, y, min(tile_size, pixel_width - x), min(tile_size, pixel_height - y))
+        for y in range(0, pixel_height, tile_size)
+        for x in range(0, pixel_width, tile_size)
+    ]
+    renders = [executor.submit(render_tile, cuts, outlines, engravings, dpi / MM_PER_INCH, *tile) for tile in tiles]
+
+    pixels = np.zeros((pixel_height, pixel_width, 4), dtype=np.uint8)
+    for (x, y, tile_width, tile_height), tile in zip(tiles, renders):
+        pixels[y:y + tile_height, x:x + tile_width] = tile.result()
+    return pixels
+
+def halve(pixels):
+    """ Next mipmap level: pixels averaged in 2x2 blocks (an odd last row or column is repeated) """
+    height, width, _ = pixels.shape
+    padded = np.pad(pixels, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge")
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, 4)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).round().astype(np.uint8)
+
+def mipmaps(pixels):
+    """ The mipmap pyramid of an image: itself, then halved down to 1x1 """
+    levels = [pixels]
+    while max(levels[-1].shape[:2]) > 1:
+        levels.append(halve(levels[-1]))
+    return levels
+
+def resize(pixels, width, height):
+    """ Scales an image down to `width` x `height`, through its mipmap levels and then a smooth scaling """
+    while pixels.shape[0] >= 2 * height and pixels.shape[1] >= 2 * width:
+        pixels = halve(pixels)
+    if pixels.shape[:2] == (height, width):
+        return pixels
+
+    import cairo
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    context = cairo.Context(surface)
+    context.scale(width / pixels.shape[1], height / pixels.shape[0])
+    context.set_source_surface(_surface(pixels))
+    context.get_source().set_filter(cairo.FILTER_GOOD)
+    context.paint()
+    return _pixels(surface)
+
+def to_png(pixels):
+    buffer = io.BytesIO()
+    _surface(pixels).write_to_png(buffer)
+    return buffer.getvalue()
+
+def from_png(data):
+    import cairo
+    return _pixels(cairo.ImageSurface.create_from_png(io.BytesIO(data)))
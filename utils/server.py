@@ -0,0 +1,129 @@
+"""
+JSON-lines request server.
+
+Requests are read as one JSON object per line, from a stream (e.g. stdin) or from the connections
+to a Unix socket, and handled on a bounded pool of worker threads. Everything runs in this
+process, so whatever the handler caches stays warm between requests.
+
+Each response is written as one JSON line as soon as it is ready, so responses can come out of
+order: they carry the `id` of their request, and the time it spent queued and in total.
+"""
+
+import concurrent.futures
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+
+log = logging.getLogger("server")
+
+class RequestServer:
+    def __init__(self, handler, workers=None, backlog=None):
+        """
+        Serves requests with `handler`, which takes a request dict and returns the response dict.
+
+        At most `workers` requests are handled at once, and reading stops while `backlog` more
+        are waiting for a worker.
+        """
+        workers = workers or os.cpu_count()
+        self.handler = handler
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(workers + (workers if backlog is None else backlog))
+
+    def submit(self, line, respond):
+        """ Handles a request line on a worker, passing its response dict to `respond` """
+        received = time.perf_counter()
+        self.slots.acquire()
+        try:
+            return self.executor.submit(self._handle, line, received, respond)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _handle(self, line, received, respond):
+        start = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects")
+            request_id = request.get("id")
+            response = self.handler(request)
+        except Exception as e:
+            log.exception(f"Request {request_id} failed")
+            response = { "error": f"{type(e).__name__}: {e}" }
+        finally:
+            self.slots.release()
+
+        end = time.perf_counter()
+        timings = { "queued": start - received, **response.pop("timings", {}), "total": end - received }
+        log.info(f"Request {request_id} {'failed' if 'error' in response else 'done'} in {1000 * timings['total']:.1f}ms")
+        respond({ "id": request_id, **response, "timings": timings })
+
+    def _responder(self, write):
+        lock = threading.Lock()
+        def respond(response):
+            with lock:
+                write(json.dumps(response) + "\n")
+        return respond
+
+    def _serve_lines(self, lines, write):
+        """ Serves the requests in `lines`, writing each response as soon as it's ready, until all are answered """
+        respond = self._responder(write)
+        answered = threading.Condition()
+        pending = 0
+
+        def respond_pending(response):
+            nonlocal pending
+            try:
+                respond(response)
+            finally:
+                with answered:
+                    pending -= 1
+                    answered.notify()
+
+        for line in lines:
+            if line.strip():
+                with answered:
+                    pending += 1
+                self.submit(line, respond_pending)
+        with answered:
+            answered.wait_for(lambda: pending == 0)
+
+    def serve_stream(self, input, output):
+        """ Serves the requests read from `input`, until it ends, writing the responses to `output` """
+        def write(data):
+            output.write(data)
+            output.flush()
+        self._serve_lines(input, write)
+
+    def serve_socket(self, path):
+        """ Serves the requests of every connection to a Unix socket at `path`, until interrupted """
+        server = self
+
+        class Connection(socketserver.StreamRequestHandler):
+            def handle(self):
+                def write(data):
+                    self.wfile.write(data.encode())
+                    self.wfile.flush()
+                server._serve_lines((line.decode() for line in self.rfile), write)
+
+        if os.path.exists(path):
+            os.unlink(path)
+        with socketserver.ThreadingUnixStreamServer(path, Connection) as unix_server:
+            log.info(f"Listening on {path}")
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.unlink(path)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
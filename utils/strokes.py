@@ -0,0 +1,113 @@
+"""
+Removal of duplicate strokes.
+
+Boards are built by combining geometries that often share edges, e.g. piece outlines and the holes
+they sit in, which the laser would otherwise burn twice. Strokes are split into segments, and
+wherever a segment runs along an earlier one, within a tolerance, that stretch of it is dropped.
+"""
+
+import logging
+import time
+import numpy as np
+import shapely
+from shapely.ops import linemerge
+
+from .geom import line_parts
+from .trace import traced
+
+log = logging.getLogger("strokes")
+
+def strokes(geom):
+    """ All strokes in `geom`, as an array of LineStrings and LinearRings """
+    return line_parts(geom)
+
+def segments(lines):
+    """ Line segments of `lines`, as an (N, 2, 2) array, and the index of the line of each """
+    if not len(lines):
+        return np.zeros((0, 2, 2)), np.zeros(0, dtype=int)
+    coords, index = shapely.get_coordinates(lines, return_index=True)
+    same = index[:-1] == index[1:]
+    # Degenerate segments are dropped
+    same[same] = (coords[:-1][same] != coords[1:][same]).any(axis=1)
+    return np.stack([coords[:-1][same], coords[1:][same]], axis=1), index[:-1][same]
+
+def overlaps(segs, tolerance):
+    """
+    Finds the stretches of segments running along earlier segments.
+
+    Returns `(segment, t0, t1)` arrays, where `t0 < t1` are the bounds of an overlapped stretch, as
+    fractions of the segment length.
+    """
+    lines = shapely.linestrings(segs)
+    tree = shapely.STRtree(lines)
+    earlier, later = tree.query(lines, predicate="dwithin", distance=tolerance)
+    keep = earlier < later
+    earlier, later = earlier[keep], later[keep]
+
+    # Both ends of the earlier segment must lie within tolerance of the later one's line
+    origin = segs[later, 0]
+    direction = segs[later, 1] - origin
+    length = np.linalg.norm(direction, axis=1)
+    direction /= length[:, None]
+    relative = segs[earlier] - origin[:, None, :]
+    along = np.einsum("nkj,nj->nk", relative, direction)
+    across = np.abs(relative[:, :, 0] * direction[:, None, 1] - relative[:, :, 1] * direction[:, None, 0])
+    collinear = (across <= tolerance).all(axis=1)
+
+    t0 = np.clip(along.min(axis=1) / length, 0, 1)
+    t1 = np.clip(along.max(axis=1) / length, 0, 1)
+    overlapping = collinear & ((t1 - t0) * length > tolerance)
+    return later[overlapping], t0[overlapping], t1[overlapping]
+
+@traced(vertices=True)
+def deduplicate(geom, tolerance=.02, name="strokes"):
+    """
+    Removes the stretches of strokes in `geom` that run along other strokes, within `tolerance`.
+
+    Where strokes overlap, the first one in `geom` is kept. Returns the remaining strokes as a
+    merged MultiLineString.
+    """
+    start = time.perf_counter()
+    lines = strokes(geom)
+    segs, line_index = segments(lines)
+    if not len(segs):
+        return shapely.MultiLineString()
+    total_length = float(np.linalg.norm(segs[:, 1] - segs[:, 0], axis=1).sum())
+
+    overlapped, t0, t1 = overlaps(segs, tolerance)
+
+    # Strokes without overlaps are kept whole, the others are split into the segments left over
+    touched = np.zeros(len(lines), dtype=bool)
+    touched[line_index[overlapped]] = True
+    free = touched[line_index]
+    free[overlapped] = False
+    pieces = [segs[free]]
+
+    # Merge the overlapped stretches of each segment, and keep whatever is left between them
+    order = np.lexsort((t0, overlapped))
+    overlapped, t0, t1 = overlapped[order], t0[order], t1[order]
+    groups = np.split(np.stack([t0, t1], axis=1), np.flatnonzero(np.diff(overlapped)) + 1) if len(overlapped) else []
+    for segment, intervals in zip(np.unique(overlapped), groups):
+        a, b = segs[segment]
+        kept = []
+        position = 0.
+        for lo, hi in intervals.tolist():
+            if lo > position:
+                kept.append((position, lo))
+            position = max(position, hi)
+        if position < 1:
+            kept.append((position, 1.))
+        t = np.array(kept).reshape(-1, 2)
+        pieces.append(a + (b - a) * t[:, :, None])
+
+    pieces = np.concatenate(pieces)
+    pieces = pieces[np.linalg.norm(pieces[:, 1] - pieces[:, 0], axis=1) > tolerance]
+    ret = linemerge([line for line, keep in zip(lines, ~touched) if keep] + list(shapely.linestrings(pieces)))
+    if isinstance(ret, shapely.LineString):
+        ret = shapely.MultiLineString([ret])
+
+    removed = max(0., total_length - ret.length)
+    log.info(
+        "%s: removed %.1fmm of duplicate strokes, out of %.1fmm (%.1f%%) in %.2fs",
+        name, removed, total_length, 100 * removed / total_length, time.perf_counter() - start)
+    return ret
@@ -0,0 +1,134 @@
+"""
+Streaming SVG writer for stroked geometry.
+
+Produces the same document layout cairo does for the cut and engraving files (user units in mm), but
+writes each stroked geometry as one compact `<path>`, straight from shapely coordinate arrays.
+"""
+
+import re
+import numpy as np
+import shapely
+
+from . import arcs
+from .geom import all_geoms
+
+_TRAILING_ZERO = re.compile(r"\.0(?![0-9])")
+
+def format_number(value, precision=3):
+    return _TRAILING_ZERO.sub("", repr(round(float(value), precision)))
+
+def _subpath(coords, close, precision):
+    points = np.round(coords, precision).tolist()
+    return "M" + "L".join([f"{x} {y}" for x, y in points]) + ("Z" if close else "")
+
+def _arc_subpath(coords, close, precision, arc_tolerance):
+    """ Like `_subpath`, with runs of vertices on a circle as arcs, and the number of moves. `coords` include the closing vertex """
+    def fmt(value):
+        return format_number(value, precision)
+
+    commands = [f"M{fmt(coords[0, 0])} {fmt(coords[0, 1])}"]
+    start = coords[0]
+    moves = 0
+    for moves, move in enumerate(arcs.fit_arcs(coords, arc_tolerance), start=1):
+        end = move[1]
+        if move[0] == arcs.LINE:
+            commands.append(f"L{fmt(end[0])} {fmt(end[1])}")
+        else:
+            _, _, center, ccw = move
+            radius = fmt(np.linalg.norm(start - center))
+            # Sweep flag 1 goes from the x axis towards the y axis, ccw if the y axis points up
+            large = int(arcs.sweep(start, end, center, ccw) > np.pi)
+            commands.append(f"A{radius} {radius} 0 {large} {int(ccw)} {fmt(end[0])} {fmt(end[1])}")
+        start = end
+    if close:
+        # The closing vertex is implied by Z, unless the path ends with an arc
+        if commands[-1][0] == "L":
+            commands.pop()
+        commands.append("Z")
+    return "".join(commands), moves
+
+def _rings(geom):
+    """ Coordinates of each subpath in `geom`, with their closing vertex, and whether they are closed """
+    if isinstance(geom, shapely.Polygon):
+        return [(shapely.get_coordinates(ring), True) for ring in [geom.exterior, *geom.interiors]]
+    if isinstance(geom, shapely.LinearRing):
+        return [(shapely.get_coordinates(geom), True)]
+    return [(shapely.get_coordinates(geom), False)]
+
+def path_data(geom, precision=3, arc_tolerance=None, reduction=None):
+    """
+    SVG path data for a LineString, LinearRing or Polygon.
+
+    Curves are output as arcs where they fit within `arc_tolerance`, if given, tallying the savings
+    in `reduction`, an `arcs.Reduction`.
+    """
+    if arc_tolerance is None:
+        subpaths = [_subpath(coords[:-1] if close else coords, close, precision) for coords, close in _rings(geom)]
+        return _TRAILING_ZERO.sub("", "".join(subpaths))
+
+    subpaths = []
+    for coords, close in _rings(geom):
+        data, moves = _arc_subpath(coords, close, precision, arc_tolerance)
+        subpaths.append(data)
+        if reduction is not None:
+            flat = _TRAILING_ZERO.sub("", _subpath(coords[:-1] if close else coords, close, precision))
+            reduction.vertices += len(coords) - 1
+            reduction.moves += moves
+            reduction.size += len(data)
+            reduction.flat_size += len(flat)
+    return "".join(subpaths)
+
+class SVGWriter:
+    """
+    Writes stroked geometries to an SVG file as they come.
+
+        with SVGWriter("out.svg", width, height) as svg:
+            svg.stroke(geom, color=(0, 0, 1), line_width=.2)
+    """
+
+    def __init__(self, path, width, height, precision=3, buffering=1 << 16, arc_tolerance=None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.precision = precision
+        self.buffering = buffering
+        self.arc_tolerance = arc_tolerance
+        self.reduction = arcs.Reduction()
+        self.file = None
+
+    def __enter__(self):
+        width = format_number(self.width, self.precision)
+        height = format_number(self.height, self.precision)
+
+        self.file = open(self.path, "w", buffering=self.buffering)
+        self.file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+            f'width="{width}mm" height="{height}mm" viewBox="0 0 {width} {height}">\n')
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.write("</svg>\n")
+        self.file.close()
+        self.file = None
+
+    def stroke(self, geom, color=(0, 0, 0), line_width=.1):
+        rgb = ", ".join(f"{format_number(100 * c, 2)}%" for c in color)
+        attributes = (
+            f'fill="none" stroke-width="{format_number(line_width, self.precision)}" '
+            f'stroke-linecap="butt" stroke-linejoin="miter" stroke="rgb({rgb})" '
+            f'stroke-opacity="1" stroke-miterlimit="10"')
+
+        parts = [
+            part
+            for part in all_geoms(geom)
+            if not isinstance(part, shapely.Point) and not part.is_empty # Points not supported
+        ]
+        if not parts:
+            return
+
+        # All parts go into a single path element, written as they are converted
+        self.file.write(f'<path {attributes} d="')
+        for part in parts:
+            self.file.write(path_data(part, self.precision, self.arc_tolerance, self.reduction))
+        self.file.write('"/>\n')
@@ -0,0 +1,122 @@
+"""
+Symmetries of the tile port layout, and the index of all possible tiles.
+
+    |  |
+    0  1
+--4      6--
+
+--5      7--
+    2  3
+    |  |
+"""
+
+import functools
+import itertools
+import random
+import numpy as np
+
+# Port positions relative to the tile center, with the tile edges at ±2 and the entries at ±1
+PORT_POSITIONS = np.array([
+    (-1, -2), (1, -2),
+    (-1, 2), (1, 2),
+    (-2, -1), (-2, 1),
+    (2, -1), (2, 1),
+])
+
+def _symmetries():
+    rotation = np.array([[0, -1], [1, 0]])
+    reflection = np.array([[-1, 0], [0, 1]])
+
+    ret = []
+    for reflect, rotations in itertools.product([False, True], range(4)):
+        matrix = np.linalg.matrix_power(rotation, rotations)
+        if reflect:
+            matrix = matrix @ reflection
+
+        moved = PORT_POSITIONS @ matrix.T
+        permutation = tuple(
+            int(np.flatnonzero((PORT_POSITIONS == p).all(axis=1))[0])
+            for p in moved
+        )
+        ret.append((matrix, permutation))
+    return ret
+
+# Dihedral symmetries of the square, as (2x2 matrix, port permutation) pairs.
+# The first 4 are the rotations, the last 4 are the reflections
+SYMMETRIES = _symmetries()
+
+def normalize_link(link):
+    return tuple(sorted(link))
+
+@functools.lru_cache(maxsize = None)
+def canonical_link(link):
+    """
+    Maps a link onto the smallest link equivalent to it by rotation or reflection.
+
+    Returns `(canonical, matrix)`, where `matrix` maps the canonical link geometry (relative to
+    the tile center) back onto `link`.
+    """
+    canonical, index = min(
+        (normalize_link((permutation[link[0]], permutation[link[1]])), i)
+        for i, (_, permutation) in enumerate(SYMMETRIES)
+    )
+    # The symmetry maps `link` onto `canonical`, and its inverse (the transpose) maps it back
+    return canonical, SYMMETRIES[index][0].T
+
+def normalize_tile(links):
+    return tuple(sorted(normalize_link(link) for link in links))
+
+def transform_tile(links, permutation):
+    return normalize_tile((permutation[a], permutation[b]) for a, b in links)
+
+def _matchings(ports):
+    if not ports:
+        yield ()
+        return
+    for i in range(1, len(ports)):
+        for rest in _matchings(ports[1:i] + ports[i+1:]):
+            yield ((ports[0], ports[i]),) + rest
+
+# All 105 ways of pairing up the 8 ports, as normalized tiles, in sorted order
+ALL_TILES = tuple(_matchings(tuple(range(8))))
+
+def _tile_index():
+    canonical = []
+    index = {}
+    # Tiles are visited in sorted order, so the first tile seen of each orbit is its smallest
+    for tile in ALL_TILES:
+        if tile in index:
+            continue
+        for symmetry, (_, permutation) in enumerate(SYMMETRIES):
+            index.setdefault(transform_tile(tile, permutation), (len(canonical), symmetry))
+        canonical.append(tile)
+    return tuple(canonical), index
+
+# Tiles distinct under rotation and reflection, and the `(canonical ID, symmetry index)` of every tile
+CANONICAL_TILES, TILE_INDEX = _tile_index()
+
+def tile_symmetry(links):
+    """
+    Looks up a tile (list of links, in any order) in the tile index.
+
+    Returns `(canonical_id, rotation, reflected)`, where the tile is `CANONICAL_TILES[canonical_id]`
+    transformed by `SYMMETRIES[4 * reflected + rotation]`.
+    """
+    canonical_id, symmetry = TILE_INDEX[normalize_tile(links)]
+    return canonical_id, symmetry % 4, symmetry >= 4
+
+def distinct_tiles(exclude=(), rng=random):
+    """
+    Endless random tiles, at random orientations, with as few repeated shapes as possible.
+
+    Every canonical tile, except the ones in `exclude` (tiles, in any orientation), comes up once in
+    random order before any of them repeats; after that, all canonical tiles are dealt again.
+    """
+    excluded = {tile_symmetry(links)[0] for links in exclude}
+    ids = [i for i in range(len(CANONICAL_TILES)) if i not in excluded]
+    while True:
+        rng.shuffle(ids)
+        for canonical_id in ids:
+            _, permutation = SYMMETRIES[rng.randrange(len(SYMMETRIES))]
+            yield list(transform_tile(CANONICAL_TILES[canonical_id], permutation))
+        ids = list(range(len(CANONICAL_TILES)))
@@ -0,0 +1,253 @@
+"""
+Toolpath ordering for the laser.
+
+Between paths the laser travels with the beam off, from the end of one path to the start of the
+next. Paths are first ordered greedily, always moving to the nearest path end, and the route is then
+improved with 2-opt moves between nearby paths. Open paths may be run in either direction, and
+closed paths may start at any of their vertices.
+
+Optionally, paths inside a closed outline are all run before that outline, so that parts don't drop
+out of the sheet before everything inside them has been cut.
+"""
+
+import logging
+import math
+import time
+import numpy as np
+import shapely
+
+from .geom import POLYGON, all_geoms, line_parts
+from .trace import traced
+
+log = logging.getLogger("toolpath")
+
+def toolpaths(geom):
+    """ Coordinates of every path in `geom`, with polygons split into their rings """
+    coords, index = shapely.get_coordinates(line_parts(geom), return_index=True)
+    if not len(coords):
+        return []
+    return np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+
+def is_closed(coords):
+    return len(coords) > 3 and (coords[0] == coords[-1]).all()
+
+def travel_distance(paths, origin=(0, 0)):
+    """ Distance travelled with the beam off to run `paths` in order, starting from `origin` """
+    if not paths:
+        return 0.
+    starts = np.array([path[0] for path in paths])
+    ends = np.array([origin] + [path[-1] for path in paths[:-1]])
+    return float(np.linalg.norm(starts - ends, axis=1).sum())
+
+def nesting(paths, containers=None, tolerance=1e-6):
+    """
+    Where each path lies relative to the outlines it can be nested in.
+
+    `containers` are polygons, by default the closed paths themselves. Returns two `(path, outline)`
+    index arrays: the paths strictly inside each outline, and the paths lying on each outline.
+    """
+    if containers is None:
+        outlines = [shapely.LinearRing(path) for path in paths if is_closed(path)]
+    else:
+        polygons = all_geoms(containers)
+        outlines = list(shapely.get_rings(polygons[shapely.get_type_id(polygons) == POLYGON]))
+    if not outlines or not paths:
+        empty = np.zeros((2, 0), dtype=int)
+        return empty, empty
+
+    # Probe each path at the middle of its first segment, its vertices may be shared with other paths
+    probes = shapely.points([(path[0] + path[1]) / 2 for path in paths])
+    on = shapely.STRtree(outlines).query(probes, predicate="dwithin", distance=tolerance)
+    inside = shapely.STRtree(shapely.polygons(outlines)).query(probes, predicate="within")
+
+    # A probe that is within tolerance of an outline lies on it, whichever side it fell on
+    on_keys = set(zip(*on.tolist()))
+    inside = inside[:, [pair not in on_keys for pair in zip(*inside.tolist())]].reshape(2, -1)
+
+    # Overlapping outlines each have paths inside the other, neither is nested in the other
+    outlines_on = [[] for _ in paths]
+    for path, outline in on.T.tolist():
+        outlines_on[path].append(outline)
+    crossings = {(a, b) for path, b in inside.T.tolist() for a in outlines_on[path]}
+    nested = [
+        not any((b, a) in crossings for a in outlines_on[path])
+        for path, b in inside.T.tolist()
+    ]
+    return inside[:, nested].reshape(2, -1), on
+
+def nesting_depth(paths, containers=None):
+    """ Number of outlines around each path """
+    inside, _ = nesting(paths, containers)
+    return np.bincount(inside[0], minlength=len(paths))
+
+def _greedy(paths, origin, inside, on):
+    """
+    Nearest neighbour route, as a list of `(path, entry vertex)`.
+
+    Paths lying on an outline only become available once all paths inside it have been visited.
+    """
+    # Open paths can be entered from either end, closed paths from any vertex
+    entry_vertices = [
+        np.arange(len(path) - 1) if is_closed(path) else np.array([0, len(path) - 1])
+        for path in paths
+    ]
+    entry_counts = np.array([len(vertices) for vertices in entry_vertices])
+    entry_paths = np.repeat(np.arange(len(paths)), entry_counts)
+    entry_vertices = np.concatenate(entry_vertices)
+    path_offsets = np.concatenate([[0], np.cumsum([len(path) for path in paths])[:-1]])
+    entry_coords = np.concatenate(paths)[path_offsets[entry_paths] + entry_vertices]
+
+    noutlines = max(inside[1].max(initial=-1), on[1].max(initial=-1)) + 1
+    pending = np.bincount(inside[1], minlength=noutlines)
+    outlines_around = [[] for _ in paths]
+    for path, outline in inside.T.tolist():
+        outlines_around[path].append(outline)
+    paths_on = [[] for _ in range(noutlines)]
+    for path, outline in on.T.tolist():
+        paths_on[outline].append(path)
+    blocked = np.bincount(on[0][pending[on[1]] > 0], minlength=len(paths))
+
+    visited = np.zeros(len(paths), dtype=bool)
+    candidates = np.arange(len(entry_paths))
+    stale = 0
+    tree = shapely.STRtree(shapely.points(entry_coords))
+    position = np.asarray(origin, dtype=float)
+    radius = 1.
+    route = []
+    while len(route) < len(paths):
+        hits = candidates[tree.query(shapely.Point(position), predicate="dwithin", distance=radius)]
+        hits = hits[~visited[entry_paths[hits]]]
+        hits = hits[blocked[entry_paths[hits]] == 0]
+        if not len(hits):
+            if ((blocked == 0) & ~visited).any():
+                radius *= 2
+                continue
+            # Every remaining path waits on another (containers overlapping in a cycle), let the nearest one through
+            hits = candidates[~visited[entry_paths[candidates]]]
+
+        distances = np.linalg.norm(entry_coords[hits] - position, axis=1)
+        entry = hits[np.argmin(distances)]
+        path, vertex = entry_paths[entry], entry_vertices[entry]
+        route.append((path, vertex))
+        visited[path] = True
+        stale += entry_counts[path]
+
+        for outline in outlines_around[path]:
+            pending[outline] -= 1
+            if pending[outline] == 0:
+                np.subtract.at(blocked, paths_on[outline], 1)
+
+        # Closed paths end where they start, open ones at their other end
+        exit_vertex = vertex if is_closed(paths[path]) else len(paths[path]) - 1 - vertex
+        position = paths[path][exit_vertex]
+        radius = max(2 * distances.min(), 1.)
+
+        # Drop visited entries from the index once they are the majority
+        if 2 * stale > len(candidates):
+            candidates = candidates[~visited[entry_paths[candidates]]]
+            stale = 0
+            if len(candidates):
+                tree = shapely.STRtree(shapely.points(entry_coords[candidates]))
+    return route
+
+def _two_opt(starts, ends, origin, depths, passes=8, neighbours=8):
+    """
+    Improves a route with 2-opt moves, reversing spans of paths in place.
+
+    `starts` and `ends` are the start and end point of each path, in route order. Spans are only
+    reversed if all their paths have the same `depths`, so that nested paths stay ahead of their
+    outlines. Returns the new route order, as indices into the original lists, and whether each
+    path was reversed.
+    """
+    n = len(starts)
+    # Position 0 is the origin, which never moves
+    starts = [tuple(origin)] + [tuple(p) for p in starts]
+    ends = [tuple(origin)] + [tuple(p) for p in ends]
+    order = list(range(-1, n))
+    reversed_ = [False] * (n + 1)
+    position = np.arange(n + 1)
+    depths = np.concatenate([[-1], depths])
+
+    # Spatial index of both ends of every path
+    endpoints = np.array(starts[1:] + ends[1:]).reshape(-1, 2)
+    endpoint_paths = np.tile(np.arange(1, n + 1), 2)
+    tree = shapely.STRtree(shapely.points(endpoints))
+
+    for _ in range(passes):
+        improved = False
+
+        # Only moves that bring the end of path `a` closer to the end of some other path can help
+        lengths = [math.dist(ends[a], starts[a + 1]) for a in range(n)]
+        sources, hits = tree.query(shapely.points(ends[:n]), predicate="dwithin", distance=lengths)
+
+        # Keeping only the nearest few candidates of each path
+        distances = np.linalg.norm(endpoints[hits] - np.array(ends)[sources], axis=1)
+        nearest = np.lexsort((distances, sources))
+        sources, hits = sources[nearest], hits[nearest]
+        rank = np.arange(len(sources)) - np.searchsorted(sources, sources)
+        sources, hits = sources[rank < neighbours], hits[rank < neighbours]
+
+        for a, hit in zip(sources.tolist(), hits.tolist()):
+            hit_position = int(position[endpoint_paths[hit]])
+            for b in (hit_position, hit_position - 1):
+                lo, hi = min(a, b), max(a, b)
+                if hi <= lo or lo < 0:
+                    continue
+                before = math.dist(ends[lo], starts[lo + 1])
+                after = math.dist(ends[lo], ends[hi])
+                if hi < n:
+                    before += math.dist(ends[hi], starts[hi + 1])
+                    after += math.dist(starts[lo + 1], starts[hi + 1])
+                if after >= before - 1e-9 or np.ptp(depths[lo + 1:hi + 1]):
+                    continue
+
+                starts[lo + 1:hi + 1], ends[lo + 1:hi + 1] = ends[hi:lo:-1], starts[hi:lo:-1]
+                order[lo + 1:hi + 1] = order[hi:lo:-1]
+                reversed_[lo + 1:hi + 1] = [not r for r in reversed_[hi:lo:-1]]
+                depths[lo + 1:hi + 1] = depths[hi:lo:-1].copy()
+                position[np.array(order[lo + 1:hi + 1]) + 1] = np.arange(lo + 1, hi + 1)
+                improved = True
+        if not improved:
+            break
+
+    return order[1:], reversed_[1:]
+
+def _orient(path, vertex, reverse):
+    if is_closed(path):
+        path = np.concatenate([path[vertex:-1], path[:vertex + 1]])
+    elif vertex:
+        path = path[::-1]
+    return path[::-1] if reverse else path
+
+def order_paths(paths, origin=(0, 0), nested=False, containers=None):
+    """
+    Orders and orients `paths` (coordinate arrays) to reduce the laser travel between them.
+
+    With `nested`, all paths inside each outline (see `nesting`) are run before the outline itself.
+    """
+    if not paths:
+        return []
+
+    if nested:
+        inside, on = nesting(paths, containers)
+    else:
+        inside = on = np.zeros((2, 0), dtype=int)
+    depths = np.bincount(inside[0], minlength=len(paths))
+
+    route = _greedy(paths, origin, inside, on)
+    oriented = [_orient(paths[path], vertex, False) for path, vertex in route]
+    order, reversed_ = _two_opt(
+        [path[0] for path in oriented], [path[-1] for path in oriented], origin,
+        depths[[path for path, _ in route]])
+    return [_orient(oriented[i], 0, reverse) for i, reverse in zip(order, reversed_)]
+
+@traced(vertices=True)
+def optimize(geom, origin=(0, 0), nested=False, containers=None, name="toolpath"):
+    """ Reorders the paths of `geom` for the laser, returning them as a list of LineStrings and LinearRings """
+    start = time.perf_counter()
+    paths = toolpaths(geom)
+    ordered = order_paths(paths, origin, nested, containers)
+    log.info(
+        "%s: %d paths, travel %.1fmm -> %.1fmm in %.2fs",
+        name, len(paths), travel_distance(paths, origin), travel_distance(ordered, origin), time.perf_counter() - start)
+    return [shapely.LinearRing(path) if is_closed(path) else shapely.LineString(path) for path in ordered]
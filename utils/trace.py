@@ -0,0 +1,196 @@
+"""
+Tracing of where the build time goes.
+
+Spans time named pieces of work, either `with span(name) as s:` blocks or functions decorated with
+`@traced()`, and carry counters (e.g. vertices in and out, bytes written) set with `s.set()`.
+
+Tracing is off unless started (by the `--trace FILE` option, or the CRAZY_PATHS_TRACE=FILE environment
+variable, which name the Chrome trace file to write). While it's off, spans cost a flag check.
+
+Worker processes inherit tracing through the environment, and spool their events into a shared
+directory whenever they finish a top-level span. `finish()` merges all of them into a summary table
+(logged) and a Chrome trace-event file, which opens in Perfetto or chrome://tracing.
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import shapely
+
+# Path of the trace file, for the command line
+ENV = "CRAZY_PATHS_TRACE"
+
+# Spool directory, for worker processes
+_SPOOL_ENV = "CRAZY_PATHS_TRACE_SPOOL"
+
+log = logging.getLogger("trace")
+
+_enabled = False
+_spool = None
+_events = []
+_lock = threading.Lock()
+_local = threading.local()
+
+def _enable(spool):
+    global _enabled, _spool
+    _enabled = True
+    _spool = pathlib.Path(spool)
+    _events.clear()
+
+def _after_fork():
+    """ Forked workers start with none of their parent's events or open spans """
+    global _lock, _local
+    _events.clear()
+    _lock = threading.Lock()
+    _local = threading.local()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def enabled():
+    return _enabled
+
+def start():
+    """ Starts tracing in this process and in the worker processes it starts from now on """
+    spool = tempfile.mkdtemp(prefix="crazy-paths-trace-")
+    os.environ[_SPOOL_ENV] = spool
+    _enable(spool)
+
+def vertex_count(*objs):
+    """ Vertices of the geometries in `objs`, which can be nested in lists, tuples and dicts """
+    total = 0
+    for obj in objs:
+        if isinstance(obj, shapely.Geometry):
+            total += shapely.get_num_coordinates(obj)
+        elif isinstance(obj, np.ndarray):
+            if obj.dtype == object:
+                total += shapely.get_num_coordinates(obj.ravel()).sum()
+        elif isinstance(obj, (list, tuple)):
+            total += vertex_count(*obj)
+        elif isinstance(obj, dict):
+            total += vertex_count(*obj.values())
+    return int(total)
+
+def _flush():
+    """ Appends this process' events to its spool file """
+    with _lock:
+        if not _events:
+            return
+        with open(_spool / f"{os.getpid()}.jsonl", "a") as f:
+            f.writelines(json.dumps(event) + "\n" for event in _events)
+        _events.clear()
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def set(self, **counters):
+        self.args.update(counters)
+
+    def __enter__(self):
+        _local.depth = getattr(_local, "depth", 0) + 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        event = dict(
+            name=self.name, ph="X", ts=self.start / 1000, dur=(end - self.start) / 1000,
+            pid=os.getpid(), tid=threading.get_native_id(), args=self.args)
+        with _lock:
+            _events.append(event)
+        _local.depth -= 1
+        if _local.depth == 0:
+            _flush()
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name, **counters):
+    """ Context manager timing a block as a span named `name` """
+    return Span(name, counters) if _enabled else _NULL_SPAN
+
+def traced(name=None, vertices=False):
+    """ Decorator making every call to a function a span, counting the vertices of its arguments and result if `vertices` """
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}) as s:
+                if vertices:
+                    s.args["vertices_in"] = vertex_count(args, kwargs)
+                result = function(*args, **kwargs)
+                if vertices:
+                    s.args["vertices_out"] = vertex_count(result)
+                return result
+        return wrapper
+    return decorator
+
+def summary(events):
+    """ Rows of `(name, calls, total seconds, mean, max, {counter: total})`, by decreasing total time """
+    spans = collections.defaultdict(list)
+    for event in events:
+        spans[event["name"]].append(event)
+
+    rows = []
+    for name, group in spans.items():
+        durations = [event["dur"] / 1e6 for event in group]
+        counters = collections.Counter()
+        for event in group:
+            counters.update({ key: value for key, value in event["args"].items() if isinstance(value, (int, float)) })
+        rows.append((name, len(group), sum(durations), sum(durations) / len(group), max(durations), dict(counters)))
+    return sorted(rows, key=lambda row: -row[2])
+
+def finish(path):
+    """ Stops tracing, writing the Chrome trace of all processes to `path` and logging the summary table """
+    global _enabled
+    if not _enabled:
+        return
+    _flush()
+    _enabled = False
+    os.environ.pop(_SPOOL_ENV, None)
+
+    events = []
+    for spool_file in sorted(_spool.glob("*.jsonl")):
+        with open(spool_file) as f:
+            events += [json.loads(line) for line in f]
+    shutil.rmtree(_spool, ignore_errors=True)
+
+    with open(path, "w") as f:
+        json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+
+    lines = [f"{'span':<32} {'calls':>7} {'total':>9} {'mean':>9} {'max':>9}  counters"]
+    for name, calls, total, mean, longest, counters in summary(events):
+        lines.append(
+            f"{name[:32]:<32} {calls:>7} {total:>8.3f}s {1000 * mean:>7.2f}ms {1000 * longest:>7.2f}ms  "
+            + " ".join(f"{key}={value:.0f}" for key, value in sorted(counters.items()) if value))
+    log.info("\n".join(lines))
+    log.info(f"Wrote {len(events)} trace events to {path}")
+
+if os.environ.get(_SPOOL_ENV):
+    _enable(os.environ[_SPOOL_ENV])
@@ -0,0 +1,295 @@
+"""
+Fast simulation of Tsuro games, played with the board's tiles.
+
+Every tile is compiled, at each of its 4 rotations, into an 8-entry table with the exit port for each
+entry port, and the board is a flat array of compiled tile codes. Following a path is then just a
+walk through lookup tables, and many games are played at once with NumPy.
+
+The game played is the basic one: players start on distinct ports at the board edge, and on their
+turn place a random tile, at a random rotation, on the empty cell they are facing. Every player
+facing that cell then follows the paths up to the next empty cell. Players that leave the board, or
+whose paths run into each other, are eliminated.
+"""
+
+import collections
+import numpy as np
+
+from .tiles import SYMMETRIES
+from .parallel import process_executor
+
+# Port on the neighbouring cell each port connects to, and the (row, col) offset of that cell
+OPPOSITE_PORT = np.array([2, 3, 0, 1, 6, 7, 4, 5])
+PORT_SIDE = np.array([(-1, 0), (-1, 0), (1, 0), (1, 0), (0, -1), (0, -1), (0, 1), (0, 1)])
+
+EMPTY = -1
+
+# Outcome of each player
+SURVIVED = 0
+LEFT_BOARD = 1
+COLLIDED = 2
+
+GameResults = collections.namedtuple("GameResults", [
+    "placements",        # (G,) tiles placed in each game
+    "path_lengths",      # (G, P) tile paths followed by each player
+    "outcomes",          # (G, P) SURVIVED, LEFT_BOARD or COLLIDED
+    "eliminated_at",     # (G, P) placement on which each player was eliminated, or -1
+    "loops",             # (G,) walks that came back into the tile that was just placed
+    "tile_placements",   # (T,) times each tile was placed
+    "tile_eliminations", # (T,) players eliminated by the placement of each tile
+])
+
+def compile_tiles(tiles):
+    """
+    Compiles tiles into an (T*4, 8) exit table.
+
+    Row `4*t + r` is tile `t` rotated `r` times, and maps each entry port to its exit port.
+    """
+    exits = np.empty((len(tiles), 4, 8), dtype=np.int8)
+    for t, links in enumerate(tiles):
+        for r, (_, permutation) in enumerate(SYMMETRIES[:4]):
+            for a, b in links:
+                exits[t, r, permutation[a]] = permutation[b]
+                exits[t, r, permutation[b]] = permutation[a]
+    return exits.reshape(-1, 8)
+
+def neighbour_table(grid_size):
+    """ (n², 8) table with the cell each port of each cell leads to, or -1 for the board edge """
+    rows, cols = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    rows = rows[:, None] + PORT_SIDE[:, 0]
+    cols = cols[:, None] + PORT_SIDE[:, 1]
+    inside = (rows >= 0) & (rows < grid_size) & (cols >= 0) & (cols < grid_size)
+    return np.where(inside, rows * grid_size + cols, -1)
+
+def edge_positions(grid_size):
+    """ All (cell, port) pairs on the board edge, facing into the board """
+    cells, ports = np.nonzero(neighbour_table(grid_size) < 0)
+    return cells, ports
+
+def simulate(tiles, games=1000, grid_size=6, players=2, rng=None):
+    """ Plays `games` random games with the given tiles (lists of links), returning their `GameResults` """
+    rng = np.random.default_rng(rng)
+    exits = compile_tiles(tiles)
+    neighbours = neighbour_table(grid_size)
+    ncells = grid_size * grid_size
+    ntiles = len(tiles)
+
+    board = np.full(games * ncells, EMPTY, dtype=np.int16)
+    game_offsets = np.arange(games) * ncells
+
+    # Players are flattened as game*players + player
+    edge_cells, edge_ports = edge_positions(grid_size)
+    starts = np.argsort(rng.random((games, len(edge_cells))), axis=1)[:, :players].ravel()
+    cell = edge_cells[starts].astype(np.int64)
+    port = edge_ports[starts].astype(np.int64)
+    player_game = np.repeat(np.arange(games), players)
+    alive = np.ones(games * players, dtype=bool)
+
+    path_lengths = np.zeros(games * players, dtype=np.int64)
+    outcomes = np.full(games * players, SURVIVED, dtype=np.int8)
+    eliminated_at = np.full(games * players, -1, dtype=np.int64)
+    placements = np.zeros(games, dtype=np.int64)
+    loops = np.zeros(games, dtype=np.int64)
+    tile_placements = np.zeros(ntiles, dtype=np.int64)
+    tile_eliminations = np.zeros(ntiles, dtype=np.int64)
+    current = np.zeros(games, dtype=np.int64)
+
+    # Games go on while more than one player is alive (or while the only player is alive, for 1 player)
+    min_alive = 1 if players > 1 else 0
+    playing = np.arange(games)
+
+    for _ in range(ncells):
+        if not len(playing):
+            break
+        turn = np.arange(len(playing))
+        seats = playing[:, None] * players + np.arange(players)
+        was_alive = alive[seats]
+
+        # Current player places a random tile on the cell in front of them
+        target = cell[seats[turn, current[playing]]]
+        tile = rng.integers(ntiles, size=len(playing))
+        board[game_offsets[playing] + target] = 4 * tile + rng.integers(4, size=len(playing))
+        placements[playing] += 1
+        np.add.at(tile_placements, tile, 1)
+
+        # Players facing that cell whose paths join each other's collide, everyone else follows their path
+        facing = was_alive & (cell[seats] == target[:, None])
+        if players > 1:
+            code = board[game_offsets[playing] + target]
+            entry = np.where(facing, port[seats], -1)
+            joined = (exits[code[:, None], np.maximum(entry, 0)][:, :, None] == entry[:, None, :]) & facing[:, :, None]
+            collided = seats[joined.any(axis=2)]
+            alive[collided] = False
+            outcomes[collided] = COLLIDED
+            facing &= alive[seats]
+        walkers = seats[facing]
+        start_cell = np.broadcast_to(target[:, None], facing.shape)[facing]
+        reentered = np.zeros(len(walkers), dtype=bool)
+        active = np.arange(len(walkers))
+        while len(active):
+            w = walkers[active]
+            code = board[game_offsets[player_game[w]] + cell[w]]
+            moving = code != EMPTY
+            active, w, code = active[moving], w[moving], code[moving]
+
+            exit_port = exits[code, port[w]]
+            next_cell = neighbours[cell[w], exit_port]
+            path_lengths[w] += 1
+
+            off_board = next_cell < 0
+            alive[w[off_board]] = False
+            outcomes[w[off_board]] = LEFT_BOARD
+
+            on_board = ~off_board
+            active, w = active[on_board], w[on_board]
+            cell[w] = next_cell[on_board]
+            port[w] = OPPOSITE_PORT[exit_port[on_board]]
+            reentered[active] |= cell[w] == start_cell[active]
+
+        np.add.at(loops, player_game[walkers[reentered]], 1)
+
+        # Players ending up on the same port collide
+        is_alive = alive[seats]
+        position = cell[seats] * 8 + port[seats]
+        same = (position[:, :, None] == position[:, None, :]) & is_alive[:, :, None] & is_alive[:, None, :]
+        same[:, np.arange(players), np.arange(players)] = False
+        collided = seats[same.any(axis=2)]
+        alive[collided] = False
+        outcomes[collided] = COLLIDED
+
+        is_alive = alive[seats]
+        eliminated = was_alive & ~is_alive
+        eliminated_at[seats[eliminated]] = np.broadcast_to(placements[playing, None], eliminated.shape)[eliminated]
+        np.add.at(tile_eliminations, tile, eliminated.sum(axis=1))
+
+        # Next alive player, in turn order
+        waiting = turn
+        for _ in range(players):
+            current[playing[waiting]] = (current[playing[waiting]] + 1) % players
+            waiting = waiting[~is_alive[waiting, current[playing[waiting]]]]
+            if not len(waiting):
+                break
+
+        playing = playing[is_alive.sum(axis=1) > min_alive]
+
+    return GameResults(
+        placements=placements,
+        path_lengths=path_lengths.reshape(games, players),
+        outcomes=outcomes.reshape(games, players),
+        eliminated_at=eliminated_at.reshape(games, players),
+        loops=loops,
+        tile_placements=tile_placements,
+        tile_eliminations=tile_eliminations,
+    )
+
+def _add_counts(histogram, counts):
+    if len(counts) > len(histogram):
+        histogram = np.pad(histogram, (0, len(counts) - len(histogram)))
+    histogram[:len(counts)] += counts
+    return histogram
+
+class GameStats:
+    """
+    Streaming statistics over any number of games.
+
+    Only counts and histograms are kept, so memory doesn't grow with the number of games, and
+    stats gathered separately (e.g. by different workers) can be merged.
+    """
+
+    def __init__(self, ntiles):
+        self.games = 0
+        self.players = 0
+        self.placements = 0
+        self.loops = 0
+        self.outcomes = np.zeros(3, dtype=np.int64)
+        self.winners = 0
+        self.draws = 0
+        self.decided_by_edge = 0
+        self.path_length_histogram = np.zeros(0, dtype=np.int64)
+        self.game_length_histogram = np.zeros(0, dtype=np.int64)
+        self.tile_placements = np.zeros(ntiles, dtype=np.int64)
+        self.tile_eliminations = np.zeros(ntiles, dtype=np.int64)
+
+    def add(self, results):
+        games, players = results.outcomes.shape
+        self.games += games
+        self.players += games * players
+        self.placements += int(results.placements.sum())
+        self.loops += int(results.loops.sum())
+        self.outcomes += np.bincount(results.outcomes.ravel(), minlength=3)
+
+        survivors = (results.outcomes == SURVIVED).sum(axis=1)
+        self.winners += int((survivors == 1).sum())
+        self.draws += int((survivors == 0).sum())
+
+        # A game is decided by the last elimination before a single player was left
+        last = results.eliminated_at.max(axis=1, keepdims=True)
+        last_eliminated = (results.eliminated_at == last) & (last >= 0)
+        by_edge = (last_eliminated & (results.outcomes == LEFT_BOARD)).any(axis=1)
+        self.decided_by_edge += int((by_edge & (survivors == 1)).sum())
+
+        self.path_length_histogram = _add_counts(self.path_length_histogram, np.bincount(results.path_lengths.ravel()))
+        self.game_length_histogram = _add_counts(self.game_length_histogram, np.bincount(results.placements))
+        self.tile_placements += results.tile_placements
+        self.tile_eliminations += results.tile_eliminations
+        return self
+
+    def merge(self, other):
+        for name in ["games", "players", "placements", "loops", "outcomes", "winners", "draws", "decided_by_edge", "tile_placements", "tile_eliminations"]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in ["path_length_histogram", "game_length_histogram"]:
+            setattr(self, name, _add_counts(getattr(self, name), getattr(other, name)))
+        return self
+
+    def report(self):
+        def mean(histogram):
+            return float((np.arange(len(histogram)) * histogram).sum() / max(1, histogram.sum()))
+
+        placements = np.maximum(1, self.tile_placements)
+        return {
+            "games": self.games,
+            "placements": self.placements,
+            "mean_game_length": mean(self.game_length_histogram),
+            "mean_path_length": mean(self.path_length_histogram),
+            "elimination_rate": float(self.outcomes[LEFT_BOARD:].sum() / max(1, self.players)),
+            "collision_rate": float(self.outcomes[COLLIDED] / max(1, self.players)),
+            "loops_per_placement": self.loops / max(1, self.placements),
+            "win_rate": self.winners / max(1, self.games),
+            "draw_rate": self.draws / max(1, self.games),
+            "decided_by_edge": self.decided_by_edge / max(1, self.winners),
+            "path_length_histogram": self.path_length_histogram.tolist(),
+            "game_length_histogram": self.game_length_histogram.tolist(),
+            "tiles": [
+                {
+                    "placements": int(self.tile_placements[t]),
+                    "eliminations_per_placement": float(self.tile_eliminations[t] / placements[t]),
+                }
+                for t in range(len(self.tile_placements))
+            ],
+        }
+
+def _simulate_stats(tiles, games, grid_size, players, seed, batch_size):
+    stats = GameStats(len(tiles))
+    rng = np.random.default_rng(seed)
+    for start in range(0, games, batch_size):
+        stats.add(simulate(tiles, min(batch_size, games - start), grid_size, players, rng))
+    return stats
+
+def analyze(tiles, games, grid_size=6, players=2, seed=None, jobs=None, batch_size=10000, tasks_per_job=4):
+    """
+    Plays `games` random games with `tiles`, spread over a process pool, returning the merged `GameStats`.
+
+    Every job gets `tasks_per_job` tasks (to balance uneven ones), and each task plays its games in
+    batches of at most `batch_size`, which only bounds its memory.
+
+    Each task gets its own seed, spawned from `seed`, so results only depend on `seed` and the task count.
+    """
+    jobs = jobs or 1
+    ntasks = max(1, min(games, jobs * tasks_per_job))
+    task_games = [games // ntasks + (i < games % ntasks) for i in range(ntasks)]
+    seeds = np.random.SeedSequence(seed).spawn(ntasks)
+
+    stats = GameStats(len(tiles))
+    with process_executor(jobs) as executor:
+        for task_stats in executor.map(_simulate_stats, [tiles] * ntasks, task_games, [grid_size] * ntasks, [players] * ntasks, seeds, [batch_size] * ntasks):
+            stats.merge(task_stats)
+    return stats